@@ -1,286 +1,2638 @@
+import time
+STARTED = time.perf_counter()  # when this module began importing, for --profile-startup
+
 import random
 import datetime
 import re
 import os
+import sys
+import json
+import mmap
+import math
+import heapq
+import threading
+import argparse
+import bisect
+import contextlib
+import glob
+import itertools
+import string
+import struct
+import zlib
+from array import array
+from collections import Counter, OrderedDict, deque
+from types import MappingProxyType
+
+# Only the optional TF-IDF classifier needs NumPy, and it takes longer to
+# import than the rest of the bot, so load_numpy() imports it on first use
+np = None
+
+
+def load_numpy():
+    """Import NumPy into the module namespace (raises ImportError if missing)"""
+    global np
+    if np is None:
+        import numpy
+        np = numpy
+    return np
+
+
+_REGEX_META = set('.^$*+?{}[]|()')
+
+
+def literal_text(pattern):
+    """Return the plain text a regex pattern matches, or None if it is not a literal"""
+    chars = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            if ch.isalnum():
+                return None  # \d, \b, \1 ... are not literals
+            chars.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in _REGEX_META:
+            return None
+        else:
+            chars.append(ch)
+    if escaped:
+        return None
+    return ''.join(chars)
+
+
+def required_literal(pattern):
+    """Return a literal that occurs in every match of the regex ('' if none is known)
+
+    Only the literal run at the start of the pattern is used, which is enough
+    for patterns such as r'i am (.*)'. Patterns with alternation get ''.
+    """
+    if '|' in pattern:
+        return ''
+    chars = []
+    escaped = False
+    for ch in pattern:
+        if escaped:
+            if ch.isalnum():
+                break
+            chars.append(ch)
+            escaped = False
+        elif ch == '\\':
+            escaped = True
+        elif ch in '*?{':
+            if chars:
+                chars.pop()  # the quantified character is optional
+            break
+        elif ch in _REGEX_META:
+            break
+        else:
+            chars.append(ch)
+    return ''.join(chars)
+
+
+class IntentMatcher:
+    """Match text against all intent patterns at once, keeping first-match-wins priority
+
+    Priority is the order of categories in the responses table, then the order
+    of patterns inside each category. Literal patterns go into an Aho-Corasick
+    automaton that finds every literal in one pass over the text. Regex
+    patterns are precompiled, and the automaton also carries the literal each
+    regex needs, so a regex only runs when its literal was seen and when it
+    could still beat the best literal match.
+    """
+
+    def __init__(self, responses):
+        self.categories = []  # pattern priority -> category
+        self._patterns = {}  # pattern priority -> regex source
+        self._compiled = {}  # pattern priority -> compiled regex
+        literals = []
+        triggers = []
+        always = []
+        for category, data in responses.items():
+            if category == 'default':
+                continue
+            for pattern in data['patterns']:
+                priority = len(self.categories)
+                self.categories.append(category)
+                text = literal_text(pattern)
+                if text is not None:
+                    literals.append((priority, text))
+                    continue
+                self._patterns[priority] = pattern
+                self._compiled[priority] = re.compile(pattern)
+                needed = required_literal(pattern)
+                if needed:
+                    triggers.append((priority, needed))
+                else:
+                    always.append(priority)
+
+        self._always = tuple(always)
+        self._build_automaton(literals, triggers)
+
+    def _add_path(self, text):
+        node = 0
+        for ch in text:
+            nxt = self._goto[node].get(ch)
+            if nxt is None:
+                nxt = len(self._goto)
+                self._goto[node][ch] = nxt
+                self._goto.append({})
+                self._best.append(None)
+                self._triggers.append(())
+            node = nxt
+        return node
+
+    def _build_automaton(self, literals, triggers):
+        """Build goto/fail tables
+
+        Each node keeps the best literal priority it reports and the regexes
+        its suffixes trigger.
+        """
+        self._goto = [{}]
+        self._best = [None]
+        self._triggers = [()]
+        for priority, text in literals:
+            node = self._add_path(text)
+            if self._best[node] is None or priority < self._best[node]:
+                self._best[node] = priority
+        for priority, text in triggers:
+            node = self._add_path(text)
+            self._triggers[node] += (priority,)
+
+        self._fail = [0] * len(self._goto)
+        queue = list(self._goto[0].values())
+        for node in queue:
+            for ch, child in self._goto[node].items():
+                queue.append(child)
+                fallback = self._fail[node]
+                while fallback and ch not in self._goto[fallback]:
+                    fallback = self._fail[fallback]
+                target = self._goto[fallback].get(ch, 0)
+                self._fail[child] = target if target != child else 0
+                inherited = self._best[self._fail[child]]
+                if inherited is not None and (self._best[child] is None or inherited < self._best[child]):
+                    self._best[child] = inherited
+                self._triggers[child] += self._triggers[self._fail[child]]
+
+    def _scan(self, text):
+        """One pass over text: (lowest literal priority found, regex priorities triggered)"""
+        goto, fail, best_at, triggers_at = self._goto, self._fail, self._best, self._triggers
+        best = best_at[0]  # an empty literal matches everywhere
+        fired = []
+        node = 0
+        for ch in text:
+            while node and ch not in goto[node]:
+                node = fail[node]
+            node = goto[node].get(ch, 0)
+            found = best_at[node]
+            if found is not None and (best is None or found < best):
+                best = found
+                if best == 0:
+                    break
+            if triggers_at[node]:
+                fired.extend(triggers_at[node])
+        return best, fired
+
+    def match_pattern(self, text):
+        """Return (priority, regex match or None) of the best pattern in text, or (None, None)"""
+        best, fired = self._scan(text)
+        candidates = self._always
+        if fired:
+            candidates = sorted(set(fired).union(self._always))
+        for priority in candidates:
+            if best is not None and priority >= best:
+                break
+            compiled = self._compiled.get(priority)
+            if compiled is None:
+                compiled = self._compiled[priority] = re.compile(self._patterns[priority])
+            found = compiled.search(text)
+            if found is not None:
+                return priority, found
+        return best, None
+
+    def __getstate__(self):
+        # Compiled regexes are rebuilt on first use after unpickling
+        state = self.__dict__.copy()
+        state['_compiled'] = {}
+        return state
+
+    def match(self, text):
+        """Return the category of the highest-priority pattern found in text, or None"""
+        best = self.match_pattern(text)[0]
+        if best is None:
+            return None
+        return self.categories[best]
+
+
+class TokenMatcher:
+    """Word-boundary-aware IntentMatcher: patterns only match whole words
+
+    The text is tokenized once. Literal patterns are token sequences looked up
+    in hash indexes (one- and two-token phrases by their tokens, longer ones by
+    their first two tokens and then compared). A regex is wrapped (after any
+    leading inline flags such as "(?i)") so it can only start and end at a
+    word boundary, and it runs only when its leading words were seen
+    (patterns with no complete leading word always run) and when it could
+    still beat the best literal. Priorities, return values and pickling
+    match IntentMatcher, so either can serve a bot.
+    """
+
+    _BOUNDED = r"(?<![\w'])(?:{})(?![\w'])"
+    _INLINE_FLAGS = re.compile(r"(?:\(\?[aiLmsux]+\))+")  # global flags such as (?i) must stay first
+
+    def __init__(self, responses):
+        self.categories = []  # pattern priority -> category
+        self._patterns = {}  # pattern priority -> bounded regex source
+        self._compiled = {}  # pattern priority -> compiled regex
+        self._unigrams = {}  # token -> best literal priority
+        self._bigrams = {}  # (token, token) -> best literal priority
+        self._phrases = {}  # first two tokens -> [(priority, tokens)] of longer literals
+        self._unigram_triggers = {}  # token -> regex priorities
+        self._bigram_triggers = {}  # (token, token) -> regex priorities
+        always = []
+        for category, data in responses.items():
+            if category == 'default':
+                continue
+            for pattern in data['patterns']:
+                priority = len(self.categories)
+                self.categories.append(category)
+                text = literal_text(pattern)
+                tokens = tuple(tokenize(text)) if text is not None else ()
+                if tokens:
+                    self._add_literal(priority, tokens)
+                    continue
+                if text is not None:
+                    pattern = re.escape(text)  # no words to index, so keep it as a regex
+                flags = self._INLINE_FLAGS.match(pattern)
+                flags = flags.group() if flags else ""
+                self._patterns[priority] = flags + self._BOUNDED.format(pattern[len(flags):])
+                self._compiled[priority] = re.compile(self._patterns[priority])
+                words = self._leading_words(pattern)
+                if len(words) >= 2:
+                    self._bigram_triggers.setdefault(words[:2], []).append(priority)
+                elif words:
+                    self._unigram_triggers.setdefault(words[0], []).append(priority)
+                else:
+                    always.append(priority)
+        self._always = tuple(always)
+        # Tokens that can start a two-token key, so most tokens skip building the pair
+        self._pair_starts = frozenset(pair[0] for index in (self._bigrams, self._phrases, self._bigram_triggers)
+                                      for pair in index)
+
+    @staticmethod
+    def _leading_words(pattern):
+        """Whole words every match of the regex starts with"""
+        needed = required_literal(pattern)
+        words = tokenize(needed)
+        # The last word may be cut off by regex syntax ("hel+o" -> "hel"), so
+        # only trust it when something non-word follows it
+        if words and _TOKEN_RE.fullmatch(needed[-1]):
+            words.pop()
+        return tuple(words)
+
+    def _add_literal(self, priority, tokens):
+        if len(tokens) == 1:
+            index, key = self._unigrams, tokens[0]
+        elif len(tokens) == 2:
+            index, key = self._bigrams, tokens
+        else:
+            self._phrases.setdefault(tokens[:2], []).append((priority, tokens))
+            return
+        if key not in index or priority < index[key]:
+            index[key] = priority
+
+    def _scan(self, text):
+        """(lowest literal priority found, regex priorities triggered) for the words of text"""
+        tokens = tokenize(text)
+        unigrams, bigrams, phrases = self._unigrams, self._bigrams, self._phrases
+        unigram_triggers, bigram_triggers = self._unigram_triggers, self._bigram_triggers
+        pair_starts = self._pair_starts
+        best = None
+        fired = []
+        last = len(tokens) - 1
+        for i, token in enumerate(tokens):
+            found = unigrams.get(token)
+            if found is not None and (best is None or found < best):
+                best = found
+            if token in unigram_triggers:
+                fired.extend(unigram_triggers[token])
+            if i == last or token not in pair_starts:
+                continue
+            pair = (token, tokens[i + 1])
+            found = bigrams.get(pair)
+            if found is not None and (best is None or found < best):
+                best = found
+            if pair in bigram_triggers:
+                fired.extend(bigram_triggers[pair])
+            for priority, phrase in phrases.get(pair, ()):
+                if (best is None or priority < best) and tuple(tokens[i:i + len(phrase)]) == phrase:
+                    best = priority
+        return best, fired
+
+    # Candidate regexes are checked exactly as IntentMatcher does
+    match_pattern = IntentMatcher.match_pattern
+    match = IntentMatcher.match
+    __getstate__ = IntentMatcher.__getstate__
+
+
+def bounded_edit_distance(a, b, limit):
+    """Levenshtein distance between a and b, or limit + 1 once it must exceed limit"""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous = list(range(len(b) + 1))
+    for i, char_a in enumerate(a, 1):
+        current = [i]
+        row_best = i
+        for j, char_b in enumerate(b, 1):
+            value = min(previous[j - 1] + (char_a != char_b), previous[j] + 1, current[j - 1] + 1)
+            current.append(value)
+            if value < row_best:
+                row_best = value
+        if row_best > limit:
+            return limit + 1
+        previous = current
+    return previous[-1]
+
+
+def trigrams(text):
+    """Character trigrams of text, padded with a space at each end"""
+    padded = f" {text} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class FuzzyMatcher:
+    """Typo-tolerant fallback for messages no intent pattern matched exactly
+
+    Covers literal intent phrases of at least min_length characters, because
+    shorter ones ("hi", "hey") are too easy to hit by accident. A phrase allows
+    d edits (max_distance, capped so its score stays at or above threshold).
+    Candidates must contain enough of the phrase's rarest disjoint trigrams to
+    be within d edits, then share enough trigrams, and are finally checked with
+    a bounded edit distance against word windows. The best score,
+    1 - distance / len(phrase), at or above threshold wins.
+    """
+
+    def __init__(self, responses, max_distance=2, threshold=0.75, min_length=4):
+        self.max_distance = max_distance
+        self.threshold = threshold
+        # (phrase, word count, category, trigrams, min shared trigrams, edit limit)
+        self._phrases = []
+        self._pieces_index = {}  # piece -> ids of the phrases indexed under it
+        self._needed = []  # phrase id -> pieces a candidate must contain
+        self._always = []  # ids of phrases too short for the piece filter
+        for category, data in responses.items():
+            if category == 'default':
+                continue
+            for pattern in data['patterns']:
+                text = literal_text(pattern)
+                if text is None:
+                    continue
+                phrase = normalize_input(text)
+                if len(phrase) < min_length:
+                    continue
+                grams = frozenset(trigrams(phrase))
+                # A phrase can't pass the threshold with more edits than this
+                limit = min(max_distance, int(len(phrase) * (1 - threshold)))
+                self._phrases.append((phrase, len(phrase.split()), category, grams, len(grams) - 3 * limit, limit))
+
+        frequency = Counter()
+        for phrase, *_ in self._phrases:
+            frequency.update({phrase[i:i + 3] for i in range(len(phrase) - 2)})
+        penalty = (max_distance + 3) * len(self._phrases) + 1  # above any sum of trigram costs
+        for phrase_id, (phrase, _, _, _, _, limit) in enumerate(self._phrases):
+            # d edits leave all but d of the pieces unchanged
+            pieces = set(self._pieces(phrase, min(limit + 3, len(phrase)), frequency, penalty))
+            needed = len(pieces) - limit  # repeated pieces count once
+            self._needed.append(needed)
+            if needed < 1:
+                self._always.append(phrase_id)
+                continue
+            for piece in pieces:
+                self._pieces_index.setdefault(piece, []).append(phrase_id)
+        self._lengths = sorted({len(piece) for piece in self._pieces_index})
+
+    @staticmethod
+    def _pieces(phrase, parts, frequency, penalty):
+        """The parts disjoint pieces of phrase that the fewest phrases share
+
+        Pieces are trigrams, costing the number of phrases that contain them.
+        A shorter piece costs penalty per missing character, so it is only
+        used when phrase is too short to hold parts disjoint trigrams.
+        """
+        size = len(phrase)
+        gram_cost = [frequency[phrase[i:i + 3]] for i in range(size - 2)]
+        # best[k][end]: lowest cost of k pieces within phrase[:end]; steps: length of the last one, 0 to skip
+        best = [[0] * (size + 1)]
+        steps = []
+        for k in range(1, parts + 1):
+            previous, row, step = best[-1], [math.inf] * (size + 1), [0] * (size + 1)
+            for end in range(1, size + 1):
+                row[end] = row[end - 1]
+                for length in (3, 2, 1):
+                    if length > end:
+                        continue
+                    cost = gram_cost[end - 3] if length == 3 else penalty * (3 - length)
+                    if previous[end - length] + cost < row[end]:
+                        row[end], step[end] = previous[end - length] + cost, length
+            best.append(row)
+            steps.append(step)
+        pieces, end = [], size
+        for step in reversed(steps):
+            while step[end] == 0:
+                end -= 1
+            pieces.append(phrase[end - step[end]:end])
+            end -= step[end]
+        return pieces
+
+    def match(self, text):
+        """Return (category, score) for the closest phrase, or (None, 0.0)"""
+        normalized = normalize_input(text)
+        if not normalized or not self._phrases:
+            return None, 0.0
+        index = self._pieces_index
+        found = {normalized[start:start + length] for length in self._lengths
+                 for start in range(len(normalized) - length + 1)}
+        hits = Counter()
+        for piece in found & index.keys():
+            hits.update(index[piece])
+        needed = self._needed
+        candidates = [phrase_id for phrase_id, count in hits.items() if count >= needed[phrase_id]]
+        candidates.extend(self._always)
+        if not candidates:
+            return None, 0.0
+        grams = trigrams(normalized)
+
+        words = normalized.split()
+        best_category, best_score = None, 0.0
+        for phrase_id in sorted(candidates):  # table order, so ties go to the earlier intent
+            phrase, size, category, phrase_grams, min_shared, limit = self._phrases[phrase_id]
+            if len(phrase_grams & grams) < min_shared:
+                continue
+            # Allow one word more or less so split/joined words still line up
+            for width in range(max(1, size - 1), size + 2):
+                for start in range(0, max(1, len(words) - width + 1)):
+                    window = " ".join(words[start:start + width])
+                    distance = bounded_edit_distance(window, phrase, limit)
+                    if distance > limit:
+                        continue
+                    score = 1 - distance / len(phrase)
+                    if score > best_score:
+                        best_category, best_score = category, score
+        if best_score < self.threshold:
+            return None, 0.0
+        return best_category, best_score
+
+
+def training_text(pattern):
+    """The words a pattern spells out, with regex syntax dropped ("i\\'m (.*)" -> "i'm")"""
+    text = literal_text(pattern)
+    if text is not None:
+        return text
+    pattern = re.sub(r"\(\?P<\w+>", "(", pattern.replace("\\'", "'"))
+    return re.sub(r"\\[A-Za-z]|[^\w\s']", " ", pattern)
+
+
+def tfidf_terms(text):
+    """Unigram and bigram terms of a message, in order"""
+    words = tokenize(text)
+    return words + [f"{a} {b}" for a, b in zip(words, words[1:])]
+
+
+class TfidfClassifier:
+    """Score messages against intents by TF-IDF cosine similarity (needs NumPy)
+
+    Every pattern (with regex syntax dropped) and every example utterance of a
+    category is one row of an L2-normalised TF-IDF matrix over word unigrams
+    and bigrams, built once. The matrix is stored by term (CSC), so scoring a
+    message only reads the columns of its own terms: one gather and a
+    bincount make the sparse dot product against every row at once. Rows are
+    grouped by category and a category scores its best row. Scores below
+    min_confidence count as no match, so callers can fall back to the regex
+    matcher.
+    """
+
+    def __init__(self, responses, min_confidence=0.5):
+        try:
+            load_numpy()
+        except ImportError:
+            raise RuntimeError("NumPy is required for the TF-IDF classifier (pip install numpy)")
+        self.min_confidence = min_confidence
+        self.categories = []
+        self.vocabulary = {}
+        row_counts = []
+        row_starts = []
+        entries = []  # (row, term id, count)
+        for category, data in responses.items():
+            if category == 'default':
+                continue
+            texts = [training_text(p) for p in data['patterns']] + list(data.get('examples', ()))
+            start = len(row_counts)
+            for text in texts:
+                counts = {}
+                for term in tfidf_terms(text):
+                    term_id = self.vocabulary.setdefault(term, len(self.vocabulary))
+                    counts[term_id] = counts.get(term_id, 0) + 1
+                if counts:
+                    entries.extend((len(row_counts), term_id, n) for term_id, n in counts.items())
+                    row_counts.append(len(counts))
+            if len(row_counts) > start:
+                self.categories.append(category)
+                row_starts.append(start)
+
+        rows = np.array([e[0] for e in entries], dtype=np.int32)
+        terms = np.array([e[1] for e in entries], dtype=np.int32)
+        tf = 1 + np.log(np.array([e[2] for e in entries], dtype=np.float32))
+        n_rows = len(row_counts)
+        df = np.bincount(terms, minlength=len(self.vocabulary))
+        # Smoothed IDF, as if one extra row held every term
+        self.idf = (np.log((1 + n_rows) / (1 + df)) + 1).astype(np.float32)
+        self._unseen_idf = math.log(1 + n_rows) + 1  # what a term in no row would get
+        values = tf * self.idf[terms]
+        norms = np.sqrt(np.bincount(rows, weights=values * values, minlength=n_rows))
+        values = (values / norms[rows]).astype(np.float32)
+
+        order = np.argsort(terms, kind='stable')
+        self._rows = rows[order]
+        self._values = values[order]
+        self._indptr = np.concatenate(([0], np.cumsum(df))).astype(np.int64)
+        self._n_rows = n_rows
+        self._row_starts = np.array(row_starts, dtype=np.int64)
+
+    def _query(self, text):
+        """(term ids, weights) of a message's L2-normalised TF-IDF vector
+
+        Terms the classifier never saw have no column to score against, but
+        they still count towards the norm (at the highest IDF, as the rarest
+        terms), so a message that is mostly unknown words scores low.
+        """
+        counts = {}
+        unseen = {}
+        for term in tfidf_terms(text):
+            term_id = self.vocabulary.get(term)
+            if term_id is not None:
+                counts[term_id] = counts.get(term_id, 0) + 1
+            else:
+                unseen[term] = unseen.get(term, 0) + 1
+        if not counts:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32)
+        term_ids = np.fromiter(counts.keys(), dtype=np.int64, count=len(counts))
+        weights = (1 + np.log(np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))) * self.idf[term_ids]
+        norm = weights @ weights + sum((1 + math.log(n)) ** 2 for n in unseen.values()) * self._unseen_idf ** 2
+        return term_ids, weights / np.sqrt(norm)
+
+    def _gather(self, term_ids):
+        """Positions in the CSC arrays of every entry in the given term columns"""
+        starts = self._indptr[term_ids]
+        lengths = self._indptr[term_ids + 1] - starts
+        total = int(lengths.sum())
+        # Position k of column j is starts[j] + k: one arange, shifted per column
+        offsets = np.repeat(starts - np.concatenate(([0], np.cumsum(lengths)[:-1])), lengths)
+        return np.arange(total, dtype=np.int64) + offsets, lengths
+
+    def scores(self, texts):
+        """Matrix of cosine scores, one row per text and one column per category"""
+        parts = [self._query(text) for text in texts]
+        if not parts or not self.categories:
+            return np.zeros((len(parts), len(self.categories)), dtype=np.float32)
+        term_ids = np.concatenate([p[0] for p in parts])
+        weights = np.concatenate([p[1] for p in parts])
+        owner = np.repeat(np.arange(len(parts), dtype=np.int64), [len(p[0]) for p in parts])
+        positions, lengths = self._gather(term_ids)
+        cells = np.repeat(owner, lengths) * self._n_rows + self._rows[positions]
+        row_scores = np.bincount(cells, weights=self._values[positions] * np.repeat(weights, lengths),
+                                 minlength=len(parts) * self._n_rows).reshape(len(parts), self._n_rows)
+        return np.maximum.reduceat(row_scores, self._row_starts, axis=1)
+
+    def classify_batch(self, texts):
+        """[(category, score)] per text, with category None below min_confidence"""
+        scores = self.scores(texts)
+        if not self.categories:
+            return [(None, 0.0)] * len(texts)
+        best = scores.argmax(axis=1)
+        results = []
+        for index, score in zip(best.tolist(), scores[np.arange(len(best)), best].tolist()):
+            category = self.categories[index] if score >= self.min_confidence else None
+            results.append((category, float(score)))
+        return results
+
+    def classify(self, text):
+        """Return (category, score) for one message; category is None below min_confidence"""
+        return self.classify_batch([text])[0]
+
+
+class Turn:
+    """One message in the conversation; unpacks like a (speaker, message) tuple"""
+    __slots__ = ('speaker', 'message')
+
+    def __init__(self, speaker, message):
+        self.speaker = speaker
+        self.message = message
+
+    def __iter__(self):
+        yield self.speaker
+        yield self.message
+
+    def __eq__(self, other):
+        return tuple(self) == tuple(other)
+
+    def __repr__(self):
+        return f"Turn({self.speaker!r}, {self.message!r})"
+
+
+_PUNCTUATION_RE = re.compile(r"[^\w\s']+")
+
+
+def normalize_input(text):
+    """A message lowercased, punctuation stripped and whitespace collapsed, for fuzzy matching
+
+    Apostrophes stay, because patterns such as r'i\'m (.*)' depend on them.
+    """
+    return " ".join(_PUNCTUATION_RE.sub(" ", text.lower()).split())
+
+
+class IntentCache:
+    """LRU cache from the text the matcher saw to the intent category it matched, with an optional TTL"""
+
+    def __init__(self, max_size=10000, ttl=3600.0):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()  # key -> (category, expires_at)
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return the cached category for key, or None"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None:
+                category, expires_at = entry
+                if expires_at is None or expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return category
+                del self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, category):
+        with self._lock:
+            expires_at = time.monotonic() + self.ttl if self.ttl else None
+            self._entries[key] = (category, expires_at)
+            self._entries.move_to_end(key)
+            if len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def __len__(self):
+        return len(self._entries)
+
+    def info(self):
+        lookups = self.hits + self.misses
+        return {
+            'size': len(self._entries),
+            'max_size': self.max_size,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': self.hits / lookups if lookups else 0.0,
+        }
+
+
+class LatencyHistogram:
+    """Log-bucketed histogram of durations in seconds
+
+    Buckets grow by a fixed ratio, so recording is O(1), memory is bounded by
+    the number of buckets in use, and percentiles come back to within about
+    5% of the true value.
+    """
+
+    RESOLUTION = 1e-6  # smallest duration told apart, in seconds
+    GROWTH = 1.05
+
+    def __init__(self):
+        self._buckets = {}
+        self._log_growth = math.log(self.GROWTH)
+        self.clear()
+
+    def clear(self):
+        self._buckets.clear()
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+
+    def record(self, seconds):
+        bucket = int(math.log(max(seconds, self.RESOLUTION) / self.RESOLUTION) / self._log_growth)
+        self._buckets[bucket] = self._buckets.get(bucket, 0) + 1
+        self.count += 1
+        self.total += seconds
+        if seconds > self.max:
+            self.max = seconds
+
+    def percentile(self, pct):
+        """Upper bound of the bucket holding the pct-th percentile, or 0.0 when empty"""
+        if not self.count:
+            return 0.0
+        rank = max(1, math.ceil(self.count * pct / 100))
+        seen = 0
+        for bucket in sorted(self._buckets):
+            seen += self._buckets[bucket]
+            if seen >= rank:
+                return min(self.RESOLUTION * self.GROWTH ** (bucket + 1), self.max)
+        return self.max
+
+    @property
+    def mean(self):
+        return self.total / self.count if self.count else 0.0
+
+    def copy(self):
+        other = LatencyHistogram()
+        other._buckets.update(self._buckets)
+        other.count, other.total, other.max = self.count, self.total, self.max
+        return other
+
+
+class Metrics:
+    """Per-stage latency histograms and counters in Prometheus text format
+
+    Bots take an optional Metrics instance. With none set, each hook costs a
+    single `is not None` check.
+    """
+
+    STAGES = ('normalize', 'match', 'dispatch', 'history_append', 'persist')
+    QUANTILES = (0.5, 0.9, 0.99)
+
+    def __init__(self):
+        self.stages = {stage: LatencyHistogram() for stage in self.STAGES}
+        self.intent_matches = {}
+        self.commands = {}
+        self.unknown_commands = 0
+        self.messages = 0
+        self._lock = threading.Lock()  # bots on several threads may share one Metrics
+
+    def observe(self, stage, seconds):
+        with self._lock:
+            self.stages[stage].record(seconds)
+
+    def count_intent(self, category):
+        with self._lock:
+            self.messages += 1
+            self.intent_matches[category] = self.intent_matches.get(category, 0) + 1
+
+    def count_command(self, command, known=True):
+        with self._lock:
+            if known:
+                self.commands[command] = self.commands.get(command, 0) + 1
+            else:
+                self.unknown_commands += 1
+
+    @staticmethod
+    def _label(value):
+        return value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+    def render(self):
+        """Return the metrics in the Prometheus text exposition format"""
+        with self._lock:
+            return self._render()
+
+    def _render(self):
+        lines = [
+            "# HELP chatbot_stage_seconds Time spent in each processing stage.",
+            "# TYPE chatbot_stage_seconds summary",
+        ]
+        for stage, histogram in self.stages.items():
+            for quantile in self.QUANTILES:
+                value = histogram.percentile(quantile * 100)
+                lines.append(f'chatbot_stage_seconds{{stage="{stage}",quantile="{quantile}"}} {value:.9f}')
+            lines.append(f'chatbot_stage_seconds_sum{{stage="{stage}"}} {histogram.total:.9f}')
+            lines.append(f'chatbot_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += [
+            "# HELP chatbot_messages_total Chat messages answered.",
+            "# TYPE chatbot_messages_total counter",
+            f"chatbot_messages_total {self.messages}",
+            "# HELP chatbot_intent_matches_total Messages answered per intent category.",
+            "# TYPE chatbot_intent_matches_total counter",
+        ]
+        for category, hits in sorted(self.intent_matches.items()):
+            lines.append(f'chatbot_intent_matches_total{{category="{self._label(category)}"}} {hits}')
+        lines += [
+            "# HELP chatbot_commands_total Slash commands run per command.",
+            "# TYPE chatbot_commands_total counter",
+        ]
+        for command, runs in sorted(self.commands.items()):
+            lines.append(f'chatbot_commands_total{{command="{self._label(command)}"}} {runs}')
+        lines += [
+            "# HELP chatbot_unknown_commands_total Slash commands that were not recognised.",
+            "# TYPE chatbot_unknown_commands_total counter",
+            f"chatbot_unknown_commands_total {self.unknown_commands}",
+        ]
+        return "\n".join(lines) + "\n"
+
+
+class ConversationStats:
+    """Running conversation aggregates, updated as each turn is recorded"""
+
+    def __init__(self):
+        self.messages = {}
+        self.words = {}
+        self.chars = {}
+        self.last = {}
+        self.intents = {}
+        self.latency = LatencyHistogram()
+
+    def add_turn(self, speaker, message):
+        self.messages[speaker] = self.messages.get(speaker, 0) + 1
+        self.words[speaker] = self.words.get(speaker, 0) + len(message.split())
+        self.chars[speaker] = self.chars.get(speaker, 0) + len(message)
+        self.last[speaker] = message
+
+    def add_reply(self, category, seconds):
+        """Count an answered message by intent category and record how long it took"""
+        self.intents[category] = self.intents.get(category, 0) + 1
+        self.latency.record(seconds)
+
+    def top_intents(self, limit=5):
+        """Most frequent intent categories as (category, hits), busiest first"""
+        return heapq.nlargest(limit, self.intents.items(), key=lambda item: item[1])
+
+    def copy(self):
+        """A snapshot that later turns don't change"""
+        other = ConversationStats()
+        for name in ('messages', 'words', 'chars', 'last', 'intents'):
+            getattr(other, name).update(getattr(self, name))
+        other.latency = self.latency.copy()
+        return other
+
+    def clear(self):
+        self.messages.clear()
+        self.words.clear()
+        self.chars.clear()
+        self.last.clear()
+        self.intents.clear()
+        self.latency.clear()
+
+
+class ConversationStore:
+    """Conversation history with a retention cap and running per-speaker indexes
+
+    Only the newest ``max_turns`` turns stay in memory. Older turns are appended
+    to ``spill_path`` (in the same "speaker: message" format save_conversation
+    uses) or dropped when no spill file is configured. An existing file is never
+    overwritten: spill_path moves on to <name>_1, <name>_2, ... until a free name
+    is found. Turn ids are 0-based and count every turn ever appended, so ids
+    stay stable after spilling.
+    """
+
+    def __init__(self, max_turns=None, spill_path=None):
+        self.max_turns = max_turns
+        self.spill_path = spill_path
+        self.spilled = 0  # turns no longer held in memory
+        self._turns = deque()
+        self._spill_file = None
+        self._spill_created = False  # spill_path is a file this store created
+        self.stats = ConversationStats()
+
+    def append(self, turn, intent=None):
+        """Add a turn (a Turn or a (speaker, message) pair) and update the indexes
+
+        intent is the category matched for the turn; only stores that persist
+        turns (SQLiteStore) keep it.
+        """
+        speaker, message = turn
+        if not isinstance(turn, Turn):
+            turn = Turn(speaker, message)
+        self._turns.append(turn)
+        self.stats.add_turn(speaker, message)
+        if self.max_turns is not None and len(self._turns) > self.max_turns:
+            self._evict()
+        return len(self) - 1
+
+    def _evict(self):
+        old = self._turns.popleft()
+        self.spilled += 1
+        if self.spill_path:
+            if self._spill_file is None:
+                self._spill_file = self._open_spill()
+            self._spill_file.write(f"{old.speaker}: {old.message}\n")
+
+    def _open_spill(self):
+        if self._spill_created:
+            return open(self.spill_path, 'a', encoding='utf-8')
+        root, ext = os.path.splitext(self.spill_path)
+        for n in itertools.count(1):
+            try:
+                file = open(self.spill_path, 'x', encoding='utf-8')
+                break
+            except FileExistsError:
+                self.spill_path = f"{root}_{n}{ext}"  # never overwrite an existing file
+        self._spill_created = True
+        return file
+
+    def __len__(self):
+        return self.spilled + len(self._turns)
+
+    def __bool__(self):
+        return len(self) > 0
+
+    def __iter__(self):
+        """Iterate over the turns still held in memory"""
+        return iter(self._turns)
+
+    def __reversed__(self):
+        return reversed(self._turns)
+
+    @property
+    def first_id(self):
+        """Id of the oldest turn still held in memory"""
+        return self.spilled
+
+    def get(self, turn_id):
+        """Return the turn with this id, or None if it is no longer in memory"""
+        index = turn_id - self.spilled
+        if 0 <= index < len(self._turns):
+            return self._turns[index]
+        return None
+
+    def iter_range(self, start_id, end_id):
+        """Yield (turn_id, turn) for ids start_id <= id < end_id, reading spilled turns from disk
+
+        Without a spill file, ids of dropped turns are skipped.
+        """
+        end_id = min(end_id, len(self))
+        if not self.spill_path:
+            start_id = max(start_id, self.spilled)  # evicted turns were dropped
+        if start_id >= self.spilled:
+            turns = itertools.islice(self._turns, start_id - self.spilled, end_id - self.spilled)
+        else:
+            turns = itertools.islice(self.iter_all(), start_id, end_id)
+        yield from zip(itertools.count(start_id), turns)
+
+    def iter_newest(self):
+        """Yield (turn_id, turn) for the turns in memory, newest first"""
+        newest = len(self) - 1
+        for offset, turn in enumerate(reversed(self._turns)):
+            yield newest - offset, turn
+
+    def iter_all(self):
+        """Iterate over every turn, reading spilled turns back from disk"""
+        if self._spill_file is not None:
+            self._spill_file.flush()
+            with open(self.spill_path, encoding='utf-8') as spill:
+                for line in spill:
+                    speaker, _, message = line.rstrip('\n').partition(': ')
+                    yield Turn(speaker, message)
+        yield from self._turns
+
+    def set_intent(self, turn_id, intent):
+        """Record the intent matched for an earlier turn (kept only by SQLiteStore)"""
+
+    def count(self, speaker=None):
+        """Number of messages from speaker (or from everyone)"""
+        if speaker is None:
+            return len(self)
+        return self.stats.messages.get(speaker, 0)
+
+    def words(self, speaker):
+        """Total number of words speaker has sent"""
+        return self.stats.words.get(speaker, 0)
+
+    def last_message(self, speaker):
+        """Most recent message from speaker, or None"""
+        return self.stats.last.get(speaker)
+
+    def clear(self):
+        """Forget every turn and reset the indexes"""
+        self.close()
+        if self._spill_created:
+            open(self.spill_path, 'w', encoding='utf-8').close()
+        self._turns.clear()
+        self.spilled = 0
+        self.stats.clear()
+
+    def close(self):
+        """Flush and close the spill file"""
+        if self._spill_file is not None:
+            self._spill_file.close()
+            self._spill_file = None
+
+
+class HistoryDatabase:
+    """SQLite history shared by every session and bot using the same file
+
+    Each turn is stored with its session, its position in the session (seq),
+    a timestamp, the speaker, the matched intent and word/character counts.
+    WAL mode lets readers run next to the writer. Inserts are buffered and
+    written batch_size at a time in one transaction, and every query flushes
+    the buffer first. An FTS5 index covers message text (LIKE scans stand in
+    where SQLite lacks FTS5). Indexes on (session, seq) and on (session,
+    speaker, intent, words, chars) serve history ranges and statistics
+    without reading whole sessions.
+    """
+
+    SCHEMA = (
+        "CREATE TABLE IF NOT EXISTS sessions (id INTEGER PRIMARY KEY, bot TEXT NOT NULL, started REAL NOT NULL)",
+        "CREATE TABLE IF NOT EXISTS turns (id INTEGER PRIMARY KEY, session INTEGER NOT NULL, seq INTEGER NOT NULL, "
+        "ts REAL NOT NULL, speaker TEXT NOT NULL, message TEXT NOT NULL, intent TEXT, "
+        "words INTEGER NOT NULL, chars INTEGER NOT NULL)",
+        "CREATE UNIQUE INDEX IF NOT EXISTS turns_session_seq ON turns (session, seq)",
+        "CREATE INDEX IF NOT EXISTS turns_session_speaker ON turns (session, speaker, intent, words, chars)",
+    )
+    # Apostrophes and underscores stay inside words, as in tokenize(). flush()
+    # indexes each batch with one INSERT ... SELECT, which is several times
+    # cheaper than a per-row trigger.
+    FTS_SCHEMA = (
+        "CREATE VIRTUAL TABLE IF NOT EXISTS turns_fts USING fts5(message, content='turns', content_rowid='id', "
+        "tokenize=\"unicode61 tokenchars '''_'\")",
+    )
+    FETCH_SIZE = 500  # rows read per round trip when streaming
+
+    def __init__(self, path, batch_size=500):
+        self.path = path
+        self.batch_size = batch_size
+        self._pending = []  # [session, seq, ts, speaker, message, intent, words, chars]
+        self._lock = threading.RLock()
+        import sqlite3  # only needed with --db
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        with self._conn:
+            for statement in self.SCHEMA:
+                self._conn.execute(statement)
+        try:
+            with self._conn:
+                for statement in self.FTS_SCHEMA:
+                    self._conn.execute(statement)
+            self.fts = True
+        except sqlite3.OperationalError:
+            self.fts = False  # SQLite built without FTS5
+
+    def new_session(self, bot_name):
+        """Start a session and return its id"""
+        with self._lock, self._conn:
+            return self._conn.execute("INSERT INTO sessions (bot, started) VALUES (?, ?)",
+                                      (bot_name, time.time())).lastrowid
+
+    def has_session(self, session):
+        return bool(self._query("SELECT 1 FROM sessions WHERE id = ?", (session,)))
+
+    def append(self, session, seq, speaker, message, intent=None):
+        """Queue a turn for the next batched insert"""
+        with self._lock:
+            self._pending.append([session, seq, time.time(), speaker, message, intent,
+                                  len(message.split()), len(message)])
+            if len(self._pending) >= self.batch_size:
+                self.flush()
+
+    def set_intent(self, session, seq, intent):
+        """Set the intent of a stored (or still queued) turn"""
+        with self._lock:
+            for row in reversed(self._pending):
+                if row[0] == session and row[1] == seq:
+                    row[5] = intent
+                    return
+            with self._conn:
+                self._conn.execute("UPDATE turns SET intent = ? WHERE session = ? AND seq = ?",
+                                   (intent, session, seq))
+
+    def flush(self):
+        """Write queued turns in one transaction"""
+        with self._lock:
+            if not self._pending:
+                return
+            with self._conn:
+                self._conn.executemany(
+                    "INSERT INTO turns (session, seq, ts, speaker, message, intent, words, chars) "
+                    "VALUES (?, ?, ?, ?, ?, ?, ?, ?)", self._pending)
+                if self.fts:
+                    # The transaction holds the write lock, so the batch got the newest ids
+                    self._conn.execute("INSERT INTO turns_fts (rowid, message) SELECT id, message FROM turns "
+                                       "WHERE id > (SELECT MAX(id) FROM turns) - ?", (len(self._pending),))
+            self._pending.clear()
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            self.flush()
+            return self._conn.execute(sql, params).fetchall()
+
+    def _stream(self, sql, params=()):
+        """Yield the rows of a query, fetching FETCH_SIZE at a time"""
+        with self._lock:
+            self.flush()
+            cursor = self._conn.execute(sql, params)
+        while True:
+            with self._lock:
+                rows = cursor.fetchmany(self.FETCH_SIZE)
+            if not rows:
+                return
+            yield from rows
+
+    def count(self, session):
+        """Number of turns in a session"""
+        return self._query("SELECT COUNT(*) FROM turns WHERE session = ?", (session,))[0][0]
+
+    def iter_turns(self, session, start=0, end=None, newest_first=False):
+        """Yield (seq, speaker, message) for start <= seq < end of a session"""
+        order = "DESC" if newest_first else "ASC"
+        if end is None:
+            end = 2 ** 62
+        return self._stream("SELECT seq, speaker, message FROM turns WHERE session = ? AND seq >= ? AND seq < ? "
+                            f"ORDER BY seq {order}", (session, start, end))
+
+    def speaker_totals(self, session=None):
+        """{speaker: (messages, words, chars)} for one session, or for all of them"""
+        where, params = ("WHERE session = ?", (session,)) if session is not None else ("", ())
+        rows = self._query(f"SELECT speaker, COUNT(*), SUM(words), SUM(chars) FROM turns {where} GROUP BY speaker",
+                           params)
+        return {speaker: (messages, words, chars) for speaker, messages, words, chars in rows}
+
+    def intent_counts(self, session=None, speaker="You"):
+        """{intent: count} over speaker's turns in one session, or in all of them"""
+        where, params = "speaker = ? AND intent IS NOT NULL", (speaker,)
+        if session is not None:
+            where, params = "session = ? AND " + where, (session,) + params
+        return dict(self._query(f"SELECT intent, COUNT(*) FROM turns WHERE {where} GROUP BY intent", params))
+
+    def last_messages(self, session):
+        """{speaker: newest message} for a session"""
+        return dict(self._query("SELECT speaker, message FROM turns WHERE id IN "
+                                "(SELECT MAX(id) FROM turns WHERE session = ? GROUP BY speaker)", (session,)))
+
+    def session_count(self):
+        return self._query("SELECT COUNT(*) FROM sessions")[0][0]
+
+    def search(self, query, limit=10, offset=0, session=None):
+        """Turns containing every word of query, newest first
+
+        Returns ([(session, seq, speaker, message)], has_more). As with
+        SearchIndex, a word ending in "*" also matches longer words it starts.
+        """
+        terms = []
+        for word in query.split():
+            tokens = tokenize(word.rstrip('*'))
+            for i, token in enumerate(tokens):
+                terms.append((token, word.endswith('*') and i == len(tokens) - 1))
+        if not terms:
+            return [], False
+        if self.fts:
+            sql = ("SELECT t.session, t.seq, t.speaker, t.message FROM turns_fts "
+                   "JOIN turns t ON t.id = turns_fts.rowid WHERE turns_fts MATCH ?")
+            params = [" ".join('"{}"{}'.format(token, '*' if prefix else '') for token, prefix in terms)]
+        else:
+            sql = "SELECT t.session, t.seq, t.speaker, t.message FROM turns t WHERE 1"
+            params = []
+            for token, _ in terms:
+                sql += " AND lower(t.message) LIKE ? ESCAPE '\\'"
+                params.append("%" + token.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_') + "%")
+        rowid = "turns_fts.rowid" if self.fts else "t.id"
+        if session is not None:
+            # A session's turns lie between its first and last row ids, so the
+            # index scan can skip newer sessions instead of filtering them out
+            bounds = self._query("SELECT (SELECT id FROM turns WHERE session = ? ORDER BY seq LIMIT 1), "
+                                 "(SELECT id FROM turns WHERE session = ? ORDER BY seq DESC LIMIT 1)",
+                                 (session, session))[0]
+            if bounds[0] is None:
+                return [], False
+            sql += f" AND {rowid} BETWEEN ? AND ? AND t.session = ?"
+            params += [bounds[0], bounds[1], session]
+        # Ordering by the FTS rowid lets SQLite walk the index newest first and stop early
+        sql += f" ORDER BY {rowid} DESC LIMIT ? OFFSET ?"
+        params += [limit + 1, offset]
+        rows = self._query(sql, params)
+        return rows[:limit], len(rows) > limit
+
+    def close(self):
+        with self._lock:
+            self.flush()
+            self._conn.close()
+
+
+class SQLiteStore(ConversationStore):
+    """ConversationStore that keeps a whole session in a HistoryDatabase
+
+    Only the newest ``max_turns`` turns stay in memory. Older ones are read
+    back from the database, so resuming a session with millions of turns only
+    loads its tail and its totals. Turn ids are the turns' seq in the session.
+    Clearing the history starts a new session and leaves the old one stored.
+    """
+
+    def __init__(self, database, bot_name, session=None, max_turns=1000):
+        super().__init__(max_turns)
+        if session is not None and not database.has_session(session):
+            raise ValueError(f"no session {session} in {database.path}")
+        self.database = database
+        self.bot_name = bot_name
+        self.session = session if session is not None else database.new_session(bot_name)
+        self._resume()
+
+    def _resume(self):
+        """Load the session's tail and running totals from the database"""
+        database, session = self.database, self.session
+        total = database.count(session)
+        tail = list(database.iter_turns(session, max(0, total - self.max_turns), total))
+        self.spilled = total - len(tail)
+        self._turns.extend(Turn(speaker, message) for _, speaker, message in tail)
+        stats = self.stats
+        for speaker, (messages, words, chars) in database.speaker_totals(session).items():
+            stats.messages[speaker] = messages
+            stats.words[speaker] = words
+            stats.chars[speaker] = chars
+        stats.last.update(database.last_messages(session))
+        stats.intents.update(database.intent_counts(session))
+
+    def append(self, turn, intent=None):
+        speaker, message = turn
+        turn_id = super().append(turn)
+        self.database.append(self.session, turn_id, speaker, message, intent)
+        return turn_id
+
+    def _evict(self):
+        self._turns.popleft()  # already in the database
+        self.spilled += 1
+
+    def set_intent(self, turn_id, intent):
+        self.database.set_intent(self.session, turn_id, intent)
+
+    def iter_range(self, start_id, end_id):
+        if start_id >= self.spilled:
+            yield from super().iter_range(start_id, end_id)
+            return
+        for seq, speaker, message in self.database.iter_turns(self.session, start_id, end_id):
+            yield seq, Turn(speaker, message)
+
+    def iter_newest(self):
+        """Yield (turn_id, turn) for the whole session, newest first"""
+        for seq, speaker, message in self.database.iter_turns(self.session, newest_first=True):
+            yield seq, Turn(speaker, message)
+
+    def iter_all(self):
+        for _, speaker, message in self.database.iter_turns(self.session):
+            yield Turn(speaker, message)
+
+    def clear(self):
+        """Start a new, empty session"""
+        super().clear()
+        self.session = self.database.new_session(self.bot_name)
+
+    def close(self):
+        """Write any queued turns (the database stays open for other sessions)"""
+        self.database.flush()
+
+
+_TOKEN_RE = re.compile(r"[\w']+")
+
+
+def tokenize(text):
+    """Split text into lowercase word tokens"""
+    return _TOKEN_RE.findall(text.lower())
+
+
+MMAP_THRESHOLD = 1024 * 1024  # transcripts at least this big are read through mmap
+
+
+def _iter_raw_lines(file):
+    """Yield the raw byte lines of an open binary file"""
+    if os.fstat(file.fileno()).st_size >= MMAP_THRESHOLD:
+        with mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            yield from iter(mapped.readline, b'')
+    else:
+        yield from file
+
+
+TRANSCRIPT_TITLE = "=== Chat Conversation History ==="
+
+
+def read_transcript_header(path):
+    """Return the "Key: value" fields (such as Bot and Date) of a transcript header
+
+    A file that doesn't start with TRANSCRIPT_TITLE has no header, so {} is returned.
+    """
+    fields = {}
+    with open(path, encoding='utf-8') as file:
+        if file.readline().rstrip('\r\n') != TRANSCRIPT_TITLE:
+            return fields
+        for line in file:
+            line = line.rstrip('\r\n')
+            if not line:
+                break
+            key, sep, value = line.partition(": ")
+            if sep:
+                fields[key] = value
+    return fields
+
+
+def transcript_bot_name(path):
+    """Return the bot name from a transcript header, or None"""
+    return read_transcript_header(path).get('Bot')
+
+
+def iter_transcript(path):
+    """Yield (byte_offset, speaker, message) for each turn in a saved transcript
+
+    The file is streamed line by line, so memory use does not depend on its size.
+    """
+    with open(path, 'rb') as file:
+        offset = 0
+        in_body = False
+        for raw in _iter_raw_lines(file):
+            line = raw.decode('utf-8').rstrip('\r\n')
+            if not line:
+                if in_body:
+                    break  # blank line before the footer
+                in_body = True  # blank line after the header
+            elif in_body:
+                speaker, _, message = line.partition(': ')
+                yield offset, speaker, message
+            offset += len(raw)
+
+
+class SearchIndex:
+    """Incrementally updated inverted index from token to sorted document ids
+
+    Document ids must be added in increasing order. Query terms are ANDed
+    together; a trailing ``*`` turns a term into a prefix match. Results come
+    back newest first and the scan stops as soon as the requested page is full.
+    """
+
+    def __init__(self):
+        self._postings = {}
+        self._vocab = []  # sorted tokens for prefix lookups, rebuilt lazily
+        self._vocab_stale = False
+
+    def __len__(self):
+        return len(self._postings)
+
+    def add(self, doc_id, text):
+        """Index text under doc_id"""
+        for token in set(tokenize(text)):
+            postings = self._postings.get(token)
+            if postings is None:
+                self._postings[token] = [doc_id]
+                self._vocab_stale = True
+            else:
+                postings.append(doc_id)
+
+    def discard_before(self, doc_id):
+        """Drop every posting for documents older than doc_id"""
+        emptied = False
+        for token in list(self._postings):
+            postings = self._postings[token]
+            cut = bisect.bisect_left(postings, doc_id)
+            if cut:
+                del postings[:cut]
+                if not postings:
+                    del self._postings[token]
+                    emptied = True
+        if emptied:
+            self._vocab_stale = True
+
+    def clear(self):
+        self._postings.clear()
+        self._vocab.clear()
+        self._vocab_stale = False
+
+    def _prefix_ids(self, prefix):
+        """Set of document ids containing any token that starts with prefix"""
+        if self._vocab_stale:
+            self._vocab = sorted(self._postings)
+            self._vocab_stale = False
+        ids = set()
+        start = bisect.bisect_left(self._vocab, prefix)
+        for token in itertools.islice(self._vocab, start, None):
+            if not token.startswith(prefix):
+                break
+            ids.update(self._postings[token])
+        return ids
+
+    @staticmethod
+    def parse_query(query):
+        """Return a list of (token, is_prefix) terms"""
+        terms = []
+        for word in query.lower().split():
+            tokens = tokenize(word)
+            for i, token in enumerate(tokens):
+                terms.append((token, word.endswith('*') and i == len(tokens) - 1))
+        return terms
+
+    def search(self, query, limit=10, offset=0, min_id=0):
+        """Return (doc_ids, has_more) for one page of matches, newest first
+
+        Documents older than min_id are ignored.
+        """
+        exact = []
+        prefixed = []
+        for token, is_prefix in self.parse_query(query):
+            if is_prefix:
+                ids = self._prefix_ids(token)
+                if not ids:
+                    return [], False
+                prefixed.append(ids)
+            else:
+                postings = self._postings.get(token)
+                if postings is None:
+                    return [], False
+                exact.append(postings)
+        if not exact and not prefixed:
+            return [], False
+
+        # Walk the rarest term newest-first and probe the others
+        if exact:
+            exact.sort(key=len)
+            driver = reversed(exact[0])
+            exact = exact[1:]
+        else:
+            prefixed.sort(key=len)
+            driver = iter(sorted(prefixed[0], reverse=True))
+            prefixed = prefixed[1:]
+
+        wanted = offset + limit + 1  # one extra to know if there is another page
+        hits = []
+        for doc_id in driver:
+            if doc_id < min_id:
+                break
+            if all(self._contains(postings, doc_id) for postings in exact) and \
+                    all(doc_id in ids for ids in prefixed):
+                hits.append(doc_id)
+                if len(hits) >= wanted:
+                    break
+        return hits[offset:offset + limit], len(hits) > offset + limit
+
+    @staticmethod
+    def _contains(postings, doc_id):
+        i = bisect.bisect_left(postings, doc_id)
+        return i < len(postings) and postings[i] == doc_id
+
+
+class TranscriptIndex:
+    """Search index over saved chat_history_* transcripts and archives
+
+    Only the file number and position of each turn are kept in memory: the
+    byte offset of its line in a text transcript, or its turn number in an
+    archive. The matching turns are read back from disk when results are
+    displayed.
+    """
+
+    def __init__(self, pattern="chat_history_*.txt", archive_pattern="chat_history_*.chatz"):
+        self.pattern = pattern
+        self.archive_pattern = archive_pattern
+        self.clear()
+
+    def clear(self):
+        self.index = SearchIndex()
+        self._files = []
+        self._archives = set()  # numbers of the files that are archives
+        self._seen = {}  # path -> (size, mtime) when indexed
+        self._doc_file = array('I')
+        self._doc_offset = array('Q')
+
+    def refresh(self):
+        """Index any transcript files that are new since the last refresh"""
+        paths = set()
+        for pattern in (self.pattern, self.archive_pattern):
+            if pattern:
+                paths.update(glob.glob(pattern))
+        for path in sorted(paths):
+            self.add_file(path)
+
+    def add_file(self, path):
+        """Index one transcript file unless it is already indexed unchanged
+
+        A text transcript with an archive of the same name next to it is
+        skipped, because converting it kept the source and the archive holds
+        the same turns.
+        """
+        root, ext = os.path.splitext(path)
+        if ext != ARCHIVE_SUFFIX and os.path.exists(root + ARCHIVE_SUFFIX):
+            return
+        stat = os.stat(path)
+        signature = (stat.st_size, stat.st_mtime)
+        if self._seen.get(path) == signature:
+            return
+        if path in self._seen:
+            # The file changed after it was indexed; start over. refresh()
+            # only covers the glob patterns, so add this file back itself
+            self.clear()
+            self.refresh()
+            self.add_file(path)
+            return
+        if ext == ARCHIVE_SUFFIX and any(os.path.splitext(seen)[0] == root for seen in self._seen):
+            # Its text source was indexed before it was converted
+            self.clear()
+            self.refresh()
+            self.add_file(path)
+            return
+        self._seen[path] = signature
+        file_no = len(self._files)
+        self._files.append(path)
+        if is_transcript_archive(path):
+            self._archives.add(file_no)
+            with TranscriptArchive(path) as archive:
+                self._add_turns(file_no, archive.iter_turns())
+        else:
+            self._add_turns(file_no, iter_transcript(path))
+
+    def _add_turns(self, file_no, turns):
+        for offset, _, message in turns:
+            doc_id = len(self._doc_offset)
+            self._doc_file.append(file_no)
+            self._doc_offset.append(offset)
+            self.index.add(doc_id, message)
+
+    def search(self, query, limit=10, offset=0):
+        """Return ([(path, speaker, message)], has_more)"""
+        doc_ids, has_more = self.index.search(query, limit, offset)
+        results = []
+        archives = {}  # file number -> TranscriptArchive opened for this search
+        try:
+            for doc_id in doc_ids:
+                file_no = self._doc_file[doc_id]
+                path = self._files[file_no]
+                if file_no in self._archives:
+                    if file_no not in archives:
+                        archives[file_no] = TranscriptArchive(path)
+                    speaker, message = archives[file_no].turn(self._doc_offset[doc_id])
+                else:
+                    with open(path, 'rb') as file:
+                        file.seek(self._doc_offset[doc_id])
+                        line = file.readline().decode('utf-8').rstrip('\r\n')
+                    speaker, _, message = line.partition(': ')
+                results.append((path, speaker, message))
+        finally:
+            for archive in archives.values():
+                archive.close()
+        return results, has_more
+
+
+def write_transcript_header(file, bot_name):
+    """Write the header block save_conversation puts at the top of a transcript"""
+    file.write(TRANSCRIPT_TITLE + "\n")
+    file.write(f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
+    file.write(f"Bot: {bot_name}\n")
+    file.write("=" * 40 + "\n\n")
+
+
+def write_transcript_footer(file, total):
+    """Write the footer that closes a transcript"""
+    file.write("\n" + "=" * 40 + "\n")
+    file.write(f"Total Messages: {total}")
+
+
+class TranscriptJournal:
+    """Append-only session log written one turn at a time
+
+    The log uses the same layout as save_conversation, so everything that reads
+    transcripts can read it. Writes go through a buffer of buffer_size bytes.
+    The fsync policy is one of:
+
+    - 'never': leave flushing to the OS
+    - 'checkpoint': flush and fsync on checkpoint() (/save, /export, quit)
+    - 'always': flush and fsync after every turn
+
+    When a segment grows past max_bytes it is closed and a new one is started
+    as <name>_1.log, <name>_2.log, ... Existing files are never overwritten: a
+    segment whose name is taken moves on to the next free number.
+    """
+
+    FSYNC_POLICIES = ('never', 'checkpoint', 'always')
+
+    def __init__(self, bot_name, path=None, buffer_size=64 * 1024, fsync='checkpoint',
+                 max_bytes=10 * 1024 * 1024):
+        if fsync not in self.FSYNC_POLICIES:
+            raise ValueError(f"fsync must be one of {', '.join(self.FSYNC_POLICIES)}")
+        self.bot_name = bot_name
+        self.base_path = path or f"chat_session_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.log"
+        self.buffer_size = buffer_size
+        self.fsync = fsync
+        self.max_bytes = max_bytes
+        self.segment = 0
+        self._file = None
+        self._open()
+
+    @property
+    def path(self):
+        """Path of the segment currently being written"""
+        if self.segment == 0:
+            return self.base_path
+        root, ext = os.path.splitext(self.base_path)
+        return f"{root}_{self.segment}{ext}"
+
+    def _open(self):
+        while True:
+            try:
+                self._file = open(self.path, 'x', encoding='utf-8', buffering=self.buffer_size)
+                break
+            except FileExistsError:
+                self.segment += 1  # an earlier run's log, or another bot's started the same second
+        write_transcript_header(self._file, self.bot_name)
+        self._bytes = self._file.tell()
+        self._turns = 0
+
+    def append(self, speaker, message):
+        """Log one turn"""
+        line = f"{speaker}: {message}\n"
+        self._file.write(line)
+        self._bytes += len(line.encode('utf-8'))
+        self._turns += 1
+        if self.fsync == 'always':
+            self._sync()
+        if self.max_bytes and self._bytes >= self.max_bytes:
+            self.rotate()
+
+    def _sync(self):
+        self._file.flush()
+        os.fsync(self._file.fileno())
+
+    def checkpoint(self):
+        """Push buffered turns to disk according to the fsync policy; return the path"""
+        if self.fsync == 'never':
+            self._file.flush()
+        else:
+            self._sync()
+        return self.path
+
+    def rotate(self):
+        """Close the current segment and start the next one"""
+        self._close_segment()
+        self.segment += 1
+        self._open()
+
+    def _close_segment(self):
+        write_transcript_footer(self._file, self._turns)
+        if self.fsync != 'never':
+            self._sync()
+        self._file.close()
+
+    def close(self):
+        if self._file is not None and not self._file.closed:
+            self._close_segment()
+
+
+ARCHIVE_MAGIC = b"CHATARC1"
+ARCHIVE_SUFFIX = ".chatz"
+_ARCHIVE_FOOTER = struct.Struct('<QII8s')  # index offset, metadata length, block count, magic
+_ARCHIVE_RECORD = struct.Struct('<HI')  # speaker length, message length (UTF-8 bytes)
+
+
+def archive_codec(name):
+    """(compress, decompress) for an archive codec
+
+    zstd needs the optional zstandard package; zlib is the DEFLATE codec gzip
+    uses and always works.
+    """
+    if name == 'zlib':
+        return (lambda data: zlib.compress(data, 6)), zlib.decompress
+    if name == 'zstd':
+        try:
+            import zstandard
+        except ImportError:
+            raise RuntimeError("zstandard is required for zstd archives (pip install zstandard)")
+        return zstandard.ZstdCompressor(level=10).compress, zstandard.ZstdDecompressor().decompress
+    raise ValueError(f"unknown archive codec {name!r}")
+
+
+def default_archive_codec():
+    """zstd when the zstandard package is installed, otherwise zlib"""
+    try:
+        import zstandard
+    except ImportError:
+        return 'zlib'
+    return 'zstd'
+
+
+def is_transcript_archive(path):
+    """True if path starts with the archive magic bytes"""
+    try:
+        with open(path, 'rb') as file:
+            return file.read(len(ARCHIVE_MAGIC)) == ARCHIVE_MAGIC
+    except OSError:
+        return False
+
+
+class ArchiveWriter:
+    """Write a compressed transcript archive one turn at a time
+
+    Layout: the magic bytes, then compressed blocks of length-prefixed
+    records (speaker and message as UTF-8), then the index, then a fixed-size
+    footer. The index holds a JSON metadata object (bot name, date, codec,
+    turn count) and, for each block, its file offset and the number of its
+    first turn. A block is closed once it holds block_bytes of records, so a
+    reader only decompresses about that much to get one turn.
+    """
+
+    def __init__(self, path, bot_name, codec=None, block_bytes=64 * 1024, date=None):
+        self.path = path
+        self.bot_name = bot_name
+        self.codec = codec or default_archive_codec()
+        self._compress = archive_codec(self.codec)[0]
+        self.block_bytes = block_bytes
+        self.date = date or datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.turns = 0
+        self._block = []  # encoded records of the open block
+        self._block_size = 0
+        self._block_first = 0
+        self._offsets = []
+        self._firsts = []
+        self._file = open(path, 'xb')  # never overwrite an existing file
+        self._file.write(ARCHIVE_MAGIC)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def append(self, speaker, message):
+        """Add one turn"""
+        speaker = speaker.encode('utf-8')
+        message = message.encode('utf-8')
+        record = _ARCHIVE_RECORD.pack(len(speaker), len(message)) + speaker + message
+        self._block.append(record)
+        self._block_size += len(record)
+        self.turns += 1
+        if self._block_size >= self.block_bytes:
+            self._flush_block()
+
+    def _flush_block(self):
+        if not self._block:
+            return
+        self._offsets.append(self._file.tell())
+        self._firsts.append(self._block_first)
+        self._file.write(self._compress(b"".join(self._block)))
+        self._block.clear()
+        self._block_size = 0
+        self._block_first = self.turns
+
+    def close(self):
+        """Write the last block, the index and the footer"""
+        if self._file.closed:
+            return
+        self._flush_block()
+        index_offset = self._file.tell()
+        meta = json.dumps({'bot': self.bot_name, 'date': self.date, 'codec': self.codec,
+                           'turns': self.turns}, ensure_ascii=False).encode('utf-8')
+        count = len(self._offsets)
+        self._file.write(meta)
+        self._file.write(struct.pack(f'<{count}Q', *self._offsets))
+        self._file.write(struct.pack(f'<{count}Q', *self._firsts))
+        self._file.write(_ARCHIVE_FOOTER.pack(index_offset, len(meta), count, ARCHIVE_MAGIC))
+        self._file.close()
+
+
+class TranscriptArchive:
+    """Random access to the turns of an archive written by ArchiveWriter
+
+    Opening reads only the footer and the block index. turn() and
+    iter_turns() find the blocks they need by bisecting the first-turn
+    numbers and decompress just those, and only the records asked for are
+    decoded. The last block read is kept, so neighbouring lookups share it.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, 'rb')
+        try:
+            if self._file.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError(f"{path}: not a transcript archive")
+            size = self._file.seek(0, os.SEEK_END)
+            if size < len(ARCHIVE_MAGIC) + _ARCHIVE_FOOTER.size:
+                raise ValueError(f"{path}: truncated archive")
+            self._file.seek(size - _ARCHIVE_FOOTER.size)
+            index_offset, meta_length, count, magic = _ARCHIVE_FOOTER.unpack(self._file.read(_ARCHIVE_FOOTER.size))
+            if magic != ARCHIVE_MAGIC:
+                raise ValueError(f"{path}: truncated archive")
+            self._file.seek(index_offset)
+            meta = json.loads(self._file.read(meta_length).decode('utf-8'))
+            table = self._file.read(16 * count)
+        except BaseException:
+            self._file.close()
+            raise
+        self.bot_name = meta['bot']
+        self.date = meta['date']
+        self.codec = meta['codec']
+        self.turns = meta['turns']
+        self._decompress = archive_codec(self.codec)[1]
+        # Block i spans _offsets[i].._offsets[i + 1] and starts at turn _firsts[i]
+        self._offsets = struct.unpack_from(f'<{count}Q', table) + (index_offset,)
+        self._firsts = struct.unpack_from(f'<{count}Q', table, 8 * count)
+        self._cached = (None, None)  # (block number, (data, record starts))
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def __len__(self):
+        return self.turns
+
+    def close(self):
+        self._file.close()
+
+    def _read_block(self, block):
+        """(decompressed data, offset of each record in it) for block"""
+        if self._cached[0] == block:
+            return self._cached[1]
+        start, end = self._offsets[block], self._offsets[block + 1]
+        self._file.seek(start)
+        data = self._decompress(self._file.read(end - start))
+        # Walk the length prefixes only; records are decoded when asked for
+        starts = []
+        position = 0
+        unpack = _ARCHIVE_RECORD.unpack_from
+        header = _ARCHIVE_RECORD.size
+        while position < len(data):
+            starts.append(position)
+            speaker_length, message_length = unpack(data, position)
+            position += header + speaker_length + message_length
+        self._cached = (block, (data, starts))
+        return data, starts
+
+    @staticmethod
+    def _decode(data, position):
+        speaker_length, message_length = _ARCHIVE_RECORD.unpack_from(data, position)
+        position += _ARCHIVE_RECORD.size
+        split = position + speaker_length
+        return data[position:split].decode('utf-8'), data[split:split + message_length].decode('utf-8')
+
+    def turn(self, n):
+        """(speaker, message) of turn n (0-based)"""
+        if not 0 <= n < self.turns:
+            raise IndexError(f"turn {n} out of range")
+        block = bisect.bisect_right(self._firsts, n) - 1
+        data, starts = self._read_block(block)
+        return self._decode(data, starts[n - self._firsts[block]])
+
+    def iter_turns(self, start=0, end=None):
+        """Yield (n, speaker, message) for turns start..end-1, decompressing only their blocks"""
+        end = self.turns if end is None else min(end, self.turns)
+        if start >= end:
+            return
+        block = bisect.bisect_right(self._firsts, start) - 1
+        n = start
+        while n < end:
+            data, starts = self._read_block(block)
+            first = self._firsts[block]
+            for position in starts[n - first:end - first]:
+                yield (n,) + self._decode(data, position)
+                n += 1
+            block += 1
+
+
+def convert_transcript(path, archive_path=None, codec=None):
+    """Write a text transcript (or journal segment) as an archive; return the archive path
+
+    The archive goes next to the source with ARCHIVE_SUFFIX unless
+    archive_path is given. The source file is left in place, and an existing
+    archive is never overwritten (FileExistsError).
+    """
+    if archive_path is None:
+        archive_path = os.path.splitext(path)[0] + ARCHIVE_SUFFIX
+    header = read_transcript_header(path)
+    with ArchiveWriter(archive_path, header.get('Bot', ""), codec, date=header.get('Date')) as writer:
+        for _, speaker, message in iter_transcript(path):
+            writer.append(speaker, message)
+    return archive_path
+
+
+# Define response patterns; "{name}" is filled in with the bot's name when a
+# response is used, and named captures such as (?P<feeling>...) fill the
+# placeholders of the same name. Optional "examples" are extra phrasings that
+# only the TF-IDF classifier learns from.
+DEFAULT_RESPONSES = {
+    'greeting': {
+        'patterns': [r'hi', r'hello', r'hey', r'greetings', r'good morning', r'good afternoon', r'good evening'],
+        'examples': ["hiya there", "howdy", "nice to meet you", "yo what's up"],
+        'responses': [
+            "Hello! I'm {name}. How can I help you?",
+            "Hi there! Nice to meet you!",
+            "Hey! What's on your mind?",
+            "Greetings! How are you today?"
+        ]
+    },
+    'how_are_you': {
+        'patterns': [r'how are you', r'how do you do', r'how\'s it going', r'how are things'],
+        'examples': ["how have you been", "how's your day", "are you doing okay", "what's new with you"],
+        'responses': [
+            "I'm doing great, thanks for asking!",
+            "I'm fantastic! How about you?",
+            "Doing well, ready to chat with you!",
+            "I'm good! Always happy to talk."
+        ]
+    },
+    'name': {
+        'patterns': [r'your name', r'who are you', r'what are you', r'tell me about yourself'],
+        'examples': ["what should i call you", "what do people call you", "introduce yourself"],
+        'responses': [
+            "My name is {name}. I'm your personal chatbot assistant!",
+            "I'm {name}, created to chat with you and help where I can.",
+            "You can call me {name}. I'm here to keep you company!"
+        ]
+    },
+    'weather': {
+        'patterns': [r'weather', r'temperature', r'hot outside', r'cold outside'],
+        'examples': ["is it going to rain", "will it be sunny tomorrow", "do i need an umbrella",
+                     "what's the forecast"],
+        'responses': [
+            "I wish I could tell you the weather! But I don't have internet access.",
+            "Weather information requires an internet connection, which I don't have.",
+            "Sorry, I can't check the weather right now. You might want to look outside! 😊"
+        ]
+    },
+    'thanks': {
+        'patterns': [r'thanks', r'thank you', r'appreciate it', r'good bot'],
+        'examples': ["much appreciated", "cheers for that", "that was helpful", "you're the best"],
+        'responses': [
+            "You're welcome!",
+            "Happy to help!",
+            "Anytime!",
+            "My pleasure!"
+        ]
+    },
+    'feeling': {
+        'patterns': [r'i am (?P<feeling>.*)', r'i\'m (?P<feeling>.*)', r'i feel (?P<feeling>.*)',
+                     r'feeling (?P<feeling>.*)'],
+        'responses': [
+            "Thanks for sharing that with me.",
+            "I understand how you feel.",
+            "That's interesting. Tell me more.",
+            "I see. How long have you felt that way?",
+            "Why do you feel {feeling}?",
+            "How long have you been {feeling}?"
+        ]
+    },
+    'age': {
+        'patterns': [r'how old are you', r'your age'],
+        'examples': ["when were you born", "when were you made", "what year were you created"],
+        'responses': [
+            "I'm brand new! Just created recently.",
+            "I don't have an age like humans do. I'm just code!",
+            "I'm as old as this conversation! 😊"
+        ]
+    },
+    'hobby': {
+        'patterns': [r'what do you like', r'your hobby', r'what do you do for fun'],
+        'examples': ["what are your interests", "what do you enjoy", "anything you like doing"],
+        'responses': [
+            "I love chatting with people like you!",
+            "My favorite thing is having conversations and learning new things.",
+            "I enjoy helping people and making them smile."
+        ]
+    },
+    'default': {
+        'patterns': [],
+        'responses': [
+            "That's interesting! Tell me more.",
+            "I see. What else is on your mind?",
+            "Hmm, I'm not sure I understand fully. Could you explain?",
+            "Interesting point! Go on...",
+            "I'd love to hear more about that.",
+            "That's a good conversation topic!"
+        ]
+    }
+}
+
+# Collection of jokes
+DEFAULT_JOKES = (
+    "Why don't scientists trust atoms? Because they make up everything!",
+    "What do you call a fake noodle? An impasta!",
+    "Why did the scarecrow win an award? He was outstanding in his field!",
+    "What do you call a bear with no teeth? A gummy bear!",
+    "Why don't eggs tell jokes? They'd crack each other up!",
+    "What do you call a sleeping bull? A bulldozer!",
+    "Why did the math book look sad? Because it had too many problems!",
+    "What do you call a fish with no eyes? A fsh!",
+    "Why don't skeletons fight each other? They don't have the guts!",
+    "What do you call a can opener that doesn't work? A can't opener!"
+)
+
+# Collection of inspirational quotes
+DEFAULT_QUOTES = (
+    "The only way to do great work is to love what you do. - Steve Jobs",
+    "Believe you can and you're halfway there. - Theodore Roosevelt",
+    "It does not matter how slowly you go as long as you do not stop. - Confucius",
+    "Everything you've ever wanted is on the other side of fear. - George Addair",
+    "The future belongs to those who believe in the beauty of their dreams. - Eleanor Roosevelt"
+)
+
+# Collection of random facts
+DEFAULT_FACTS = (
+    "Honey never spoils. Archaeologists have found pots of honey in ancient Egyptian tombs that are over 3,000 years old and still perfectly edible!",
+    "A day on Venus is longer than a year on Venus. It takes 243 Earth days to rotate once but only 225 Earth days to orbit the sun.",
+    "Bananas are technically berries, while strawberries are not!",
+    "Octopuses have three hearts and blue blood!",
+    "The Eiffel Tower can be 15 cm taller during the summer due to thermal expansion!"
+)
+
+
+class SlotValues(dict):
+    """Template values where a slot that wasn't captured fills in as ''"""
+
+    def __missing__(self, key):
+        return ''
+
+
+class ResponseTemplate:
+    """A response with its "{field}" placeholders parsed once
+
+    Filling it is then a single format_map() call, or nothing at all for
+    plain text. Text that isn't a valid template (stray braces, positional or
+    dotted fields) is used as-is, with only "{name}" filled in.
+    """
+    __slots__ = ('text', 'fields', 'slots', 'literal')
+
+    _formatter = string.Formatter()
+
+    def __init__(self, text):
+        self.text = text
+        try:
+            fields = {field for _, field, _, _ in self._formatter.parse(text) if field is not None}
+            self.literal = not all(field.isidentifier() for field in fields)
+        except ValueError:
+            self.literal = True
+        if self.literal:
+            fields = {'name'} if '{name}' in text else set()
+        self.fields = frozenset(fields)
+        self.slots = self.fields - {'name'}  # what the match has to supply
+
+    def fill(self, name, slots=None):
+        if not self.fields:
+            return self.text
+        if self.literal:
+            return self.text.replace('{name}', name)
+        values = SlotValues(slots or ())
+        values['name'] = name
+        return self.text.format_map(values)
+
+
+SLOT_TRIM = " \t.,!?;:"
+
+
+class ShuffleCycle:
+    """Hand out the items of a sequence in random order without repeats
+
+    A lazy Fisher-Yates shuffle: each pick swaps a random not-yet-used item
+    into place, so a pick is O(1) and every item comes up once per cycle.
+    The first pick of a new cycle never repeats the last pick of the old one.
+    """
+    __slots__ = ('items', 'order', 'position')
+
+    def __init__(self, items):
+        self.items = items
+        self.order = list(range(len(items)))
+        self.position = 0
+
+    def pick(self, rng):
+        order = self.order
+        size = len(order)
+        i = self.position
+        if i == size:
+            i = 0
+            # The previous pick sits at the end, so leave it out of this draw
+            j = rng.randrange(size - 1) if size > 1 else 0
+        else:
+            j = rng.randrange(i, size)
+        order[i], order[j] = order[j], order[i]
+        self.position = i + 1
+        return self.items[order[i]]
+
+
+class KnowledgeBase:
+    """Read-only bot content shared by every session
+
+    Holds the intent table, jokes, quotes and facts, plus the IntentMatcher
+    compiled from them. It is built once and shared by reference, so creating
+    a bot only costs its own history. Responses are templates, and "{name}" is
+    filled in when a response is rendered. The matchers and parsed templates
+    are built on first use (or ahead of time by warm_up()), so start-up doesn't
+    wait for them.
+    """
+
+    _default = None
+    MATCHER_CACHE_VERSION = 1  # bump when IntentMatcher's pickled layout changes
+
+    def __init__(self, responses, jokes=(), quotes=(), facts=(), matcher=None):
+        table = {}
+        for category, data in responses.items():
+            entry = {'patterns': tuple(data['patterns']), 'responses': tuple(data['responses'])}
+            if data.get('examples'):
+                entry['examples'] = tuple(data['examples'])  # extra training text for the classifier
+            table[category] = MappingProxyType(entry)
+        # Keep 'default' last so it never shadows a real category
+        table['default'] = table.pop('default', MappingProxyType({'patterns': (), 'responses': ("...",)}))
+        self.responses = MappingProxyType(table)
+        self.jokes = tuple(jokes)
+        self.quotes = tuple(quotes)
+        self.facts = tuple(facts)
+        # Shared by every session using this content; reloads start a fresh one
+        self.intent_cache = IntentCache()
+        self._matcher = matcher
+        self._fuzzy = None
+        self._templates = None
+        self._classifier = None
+        self._token_matcher = None
+        # Held while a lazy part is built, so a message arriving during a
+        # background warm-up waits for it instead of building it twice
+        self._build_lock = threading.Lock()
+
+    def _build(self, attribute, factory):
+        with self._build_lock:
+            value = getattr(self, attribute)
+            if value is None:
+                value = factory()
+                setattr(self, attribute, value)
+        return value
+
+    @property
+    def matcher(self):
+        """IntentMatcher over the intents, built on first use"""
+        return self._matcher or self._build('_matcher', lambda: IntentMatcher(self.responses))
+
+    @property
+    def fuzzy(self):
+        """FuzzyMatcher over the literal intent phrases, built on first use"""
+        return self._fuzzy or self._build('_fuzzy', lambda: FuzzyMatcher(self.responses))
+
+    @property
+    def token_matcher(self):
+        """Word-boundary-aware TokenMatcher over the intents, built on first use"""
+        return self._token_matcher or self._build('_token_matcher', lambda: TokenMatcher(self.responses))
+
+    @property
+    def classifier(self):
+        """TfidfClassifier over the intents, built on first use (needs NumPy)"""
+        return self._classifier or self._build('_classifier', lambda: TfidfClassifier(self.responses))
+
+    def _parse_templates(self):
+        # Responses are parsed into templates once. Without slots a category
+        # only picks templates that need none.
+        templates = {}
+        plain_templates = {}
+        slot_patterns = {}  # category -> compiled patterns with named groups
+        for category, data in self.responses.items():
+            parsed = tuple(ResponseTemplate(text) for text in data['responses'])
+            templates[category] = parsed
+            plain_templates[category] = tuple(t for t in parsed if not t.slots) or parsed
+            named = tuple(re.compile(p) for p in data['patterns'] if '(?P<' in p)
+            if named:
+                slot_patterns[category] = named
+        return templates, plain_templates, slot_patterns
+
+    def _parsed(self):
+        return self._templates or self._build('_templates', self._parse_templates)
+
+    templates = property(lambda self: self._parsed()[0])
+    plain_templates = property(lambda self: self._parsed()[1])
+    slot_patterns = property(lambda self: self._parsed()[2])
+
+    def warm_up(self, fuzzy=False, word_boundaries=False, classifier=False):
+        """Build the templates and matchers now instead of on the first message"""
+        self.templates
+        self.token_matcher if word_boundaries else self.matcher
+        if fuzzy:
+            self.fuzzy
+        if classifier:
+            self.classifier
+
+    def current(self):
+        """The knowledge base to use right now (ContentLoader swaps this on reload)"""
+        return self
+
+    @classmethod
+    def from_file(cls, path, cache_dir=None):
+        """Load content from a JSON or YAML file
+
+        The file holds an "intents" table in the DEFAULT_RESPONSES layout plus
+        optional "jokes", "quotes" and "facts" lists; missing sections fall
+        back to the built-in content. The compiled matcher is cached in
+        cache_dir (default: .chatbot_cache next to the file) under the file's
+        name, its SHA-256 and MATCHER_CACHE_VERSION, so an unchanged file skips
+        rebuilding it. Writing a new cache entry removes the file's older ones.
+        """
+        import hashlib
+        import pickle
+        with open(path, 'rb') as file:
+            raw = file.read()
+        if path.endswith(('.yaml', '.yml')):
+            try:
+                import yaml
+            except ImportError:
+                raise RuntimeError("PyYAML is required for YAML content files (pip install pyyaml)")
+            data = yaml.safe_load(raw)
+        else:
+            data = json.loads(raw)
+        if not isinstance(data, dict):
+            raise ValueError(f"{path}: expected a mapping at the top level")
+
+        responses = data.get('intents', DEFAULT_RESPONSES)
+        jokes = data.get('jokes', DEFAULT_JOKES)
+        quotes = data.get('quotes', DEFAULT_QUOTES)
+        facts = data.get('facts', DEFAULT_FACTS)
+
+        if cache_dir is None:
+            cache_dir = os.path.join(os.path.dirname(os.path.abspath(path)), '.chatbot_cache')
+        cache_prefix = os.path.join(cache_dir, os.path.basename(path) + '.')
+        cache_path = f"{cache_prefix}{hashlib.sha256(raw).hexdigest()}.v{cls.MATCHER_CACHE_VERSION}.matcher"
+        matcher = None
+        try:
+            with open(cache_path, 'rb') as file:
+                version, cached = pickle.load(file)
+            if version == cls.MATCHER_CACHE_VERSION and isinstance(cached, IntentMatcher):
+                matcher = cached
+        except (OSError, pickle.UnpicklingError, EOFError, AttributeError, ImportError, TypeError, ValueError):
+            pass
+        knowledge = cls(responses, jokes, quotes, facts, matcher)
+        if matcher is None:
+            try:
+                os.makedirs(cache_dir, exist_ok=True)
+                temp_path = cache_path + '.tmp'
+                with open(temp_path, 'wb') as file:
+                    pickle.dump((cls.MATCHER_CACHE_VERSION, knowledge.matcher), file,
+                                protocol=pickle.HIGHEST_PROTOCOL)
+                os.replace(temp_path, cache_path)
+                # Entries for earlier versions of this file will never be read again
+                for stale in glob.glob(glob.escape(cache_prefix) + '*.matcher'):
+                    if stale != cache_path:
+                        os.remove(stale)
+            except OSError:
+                pass  # caching is only an optimisation
+        return knowledge
+
+    def to_dict(self):
+        """Content in the layout from_file() reads"""
+        return {
+            'intents': {category: {key: list(value) for key, value in data.items()}
+                        for category, data in self.responses.items()},
+            'jokes': list(self.jokes),
+            'quotes': list(self.quotes),
+            'facts': list(self.facts),
+        }
+
+    @classmethod
+    def default(cls):
+        """The built-in content, built on first use and then shared"""
+        if cls._default is None:
+            cls._default = cls(DEFAULT_RESPONSES, DEFAULT_JOKES, DEFAULT_QUOTES, DEFAULT_FACTS)
+        return cls._default
+
+    def with_intent(self, category, patterns, responses, examples=()):
+        """Return a copy with one intent category added or replaced"""
+        table = dict(self.responses)
+        table[category] = {'patterns': patterns, 'responses': responses, 'examples': examples}
+        return KnowledgeBase(table, self.jokes, self.quotes, self.facts)
+
+    def extract_slots(self, category, text, found=None, original=None):
+        """Named captures of category's patterns in text, trimmed, as a dict
+
+        found is the match the matcher already made, if any; otherwise the
+        category's patterns with named groups are searched. Values are taken
+        from original (the text before lowercasing) when the two line up.
+        """
+        patterns = self.slot_patterns.get(category)
+        if not patterns:
+            return {}
+        if found is None or not found.re.groupindex:
+            for compiled in patterns:
+                found = compiled.search(text)
+                if found is not None:
+                    break
+            else:
+                return {}
+        if original is None or len(original) != len(text):
+            original = text
+        slots = {}
+        for slot in found.re.groupindex:
+            start, end = found.span(slot)
+            if start >= 0:
+                value = original[start:end].strip(SLOT_TRIM)
+                if value:
+                    slots[slot] = value
+        return slots
+
+    def templates_for(self, category, slots=None):
+        """The templates a response for category can use, given the captured slots"""
+        if slots:
+            return self.templates[category]
+        return self.plain_templates[category]
+
+
+class ContentLoader:
+    """Keep a KnowledgeBase in step with its content file
+
+    A daemon thread polls the file and builds the new knowledge base off to
+    the side. Then it swaps the reference in one assignment, so sessions are
+    never blocked and each message sees either the old content or the new
+    content. The new knowledge base is warmed up for every mode warm_up() was
+    called with before it is swapped in, so the first message after a reload
+    doesn't wait for its matchers. If the new file doesn't load, the old
+    content stays and the error is kept in last_error.
+    """
+
+    def __init__(self, path, interval=2.0, cache_dir=None):
+        self.path = path
+        self.interval = interval
+        self.cache_dir = cache_dir
+        self.last_error = None
+        self._signature = self._stat()
+        self._knowledge = KnowledgeBase.from_file(path, cache_dir)
+        self._modes = frozenset()  # warm_up() arguments of the bots using this content
+        self._stop = threading.Event()
+        self._thread = None
+
+    def current(self):
+        return self._knowledge
+
+    def warm_up(self, fuzzy=False, word_boundaries=False, classifier=False):
+        """Warm up the current content, and every reload after it, for these modes"""
+        self._modes = self._modes | {(fuzzy, word_boundaries, classifier)}
+        self._knowledge.warm_up(fuzzy, word_boundaries, classifier)
+
+    def _stat(self):
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def reload_if_changed(self):
+        """Reload the file if it changed; return True if new content was swapped in"""
+        try:
+            signature = self._stat()
+            if signature == self._signature:
+                return False
+            knowledge = KnowledgeBase.from_file(self.path, self.cache_dir)
+            for modes in self._modes:
+                knowledge.warm_up(*modes)
+        except Exception as e:
+            self.last_error = f"{type(e).__name__}: {e}"
+            return False
+        self._signature = signature
+        self._knowledge = knowledge
+        self.last_error = None
+        return True
+
+    def start(self):
+        """Start watching the file in the background"""
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._watch, name="content-reloader", daemon=True)
+            self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _watch(self):
+        while not self._stop.wait(self.interval):
+            self.reload_if_changed()
+
+
+class Command:
+    """A registered slash command"""
+    __slots__ = ('name', 'handler', 'panel', 'exits', 'local_only')
+
+    def __init__(self, name, handler, panel=False, exits=False, local_only=False):
+        self.name = name
+        self.handler = handler
+        self.panel = panel  # full-screen output, printed without the "Bot:" prefix
+        self.exits = exits  # ends an interactive session
+        self.local_only = local_only  # reads or writes files, so refused in remote sessions
+
+
+class CommandRegistry:
+    """Map slash commands to handler callables plus their command-center metadata
+
+    A handler is called as ``handler(bot, argument)`` where argument is the text
+    after the command, and returns the reply text instead of printing it. The
+    dict lookup keeps dispatch cost constant however many commands exist, and
+    the same registry serves chat(), respond() and the server.
+    """
+
+    def __init__(self):
+        self._commands = {}
+        self.metadata = {}  # what the command center lists
+        self.help_text = None  # rendered command center, built on first /commands
+
+    def register(self, name, handler, description, category, usage=None, example=None,
+                 aliases=(), hidden=False, panel=False, exits=False, local_only=False):
+        """Register handler for name (and any aliases)"""
+        entry = Command(name, handler, panel, exits, local_only)
+        self.help_text = None
+        for command in (name,) + tuple(aliases):
+            self._commands[command] = entry
+            if not hidden:
+                self.metadata[command] = {
+                    'description': description,
+                    'category': category,
+                    'usage': usage or command,
+                    'example': example or usage or command,
+                }
+        return handler
+
+    def command(self, name, description, category, **options):
+        """Decorator form of register()"""
+        def decorator(handler):
+            return self.register(name, handler, description, category, **options)
+        return decorator
+
+    def get(self, name):
+        return self._commands.get(name)
+
+    def __contains__(self, name):
+        return name in self._commands
+
+    def __len__(self):
+        return len(self.metadata)
+
+    @staticmethod
+    def split(user_input):
+        """Split '/cmd some text' into ('/cmd', 'some text')"""
+        command, _, argument = user_input.strip().partition(' ')
+        return command.lower(), argument.strip()
+
+
+COMMANDS = CommandRegistry()
+
+
+class IntentHandlerRegistry:
+    """Map intent categories to callables that build the reply in code
+
+    A handler is called as ``handler(bot, slots, user_input)``, where slots
+    holds the named captures of the matched pattern, and returns the reply
+    text, or None to use the category's response templates as usual.
+    """
+
+    def __init__(self):
+        self._handlers = {}
+
+    def register(self, category, handler):
+        """Register handler for category, replacing any earlier one"""
+        self._handlers[category] = handler
+        return handler
+
+    def intent(self, category):
+        """Decorator form of register()"""
+        def decorator(handler):
+            return self.register(category, handler)
+        return decorator
+
+    def get(self, category):
+        return self._handlers.get(category)
+
+    def __contains__(self, category):
+        return category in self._handlers
+
+    def __len__(self):
+        return len(self._handlers)
+
+
+INTENT_HANDLERS = IntentHandlerRegistry()
+
 
 class SimpleChatBot:
-    def __init__(self, name="Buddy"):
+    commands = COMMANDS
+    intent_handlers = INTENT_HANDLERS
+    interactive = False  # True while chat() owns the terminal
+    remote = False  # True for ChatServer sessions, which may not run local_only commands
+    CLASSIFIERS = (None, 'tfidf')
+
+    def __init__(self, name="Buddy", max_history=None, spill_path=None, search_transcripts=False,
+                 journal=None, knowledge=None, metrics=None, fuzzy=False, classifier=None,
+                 word_boundaries=False, database=None, session=None, seed=None, no_repeat=False,
+                 thread_safe=False):
+        if classifier not in self.CLASSIFIERS:
+            raise ValueError(f"unknown classifier {classifier!r}")
         self.name = name
-        self.conversation_history = []
-        
-        # Command Center - All available commands with descriptions
-        self.command_center = {
-            # Chat Commands
-            '/help': {
-                'description': 'Show all available commands',
-                'category': '📋 General',
-                'usage': '/help',
-                'example': '/help'
-            },
-            '/commands': {
-                'description': 'Show command center (this menu)',
-                'category': '📋 General',
-                'usage': '/commands',
-                'example': '/commands'
-            },
-            '/clear': {
-                'description': 'Clear the screen',
-                'category': '📋 General',
-                'usage': '/clear',
-                'example': '/clear'
-            },
-            
-            # Conversation Management
-            '/history': {
-                'description': 'Show conversation history',
-                'category': '💬 Conversation',
-                'usage': '/history',
-                'example': '/history'
-            },
-            '/save': {
-                'description': 'Save conversation to file',
-                'category': '💬 Conversation',
-                'usage': '/save',
-                'example': '/save'
-            },
-            '/load': {
-                'description': 'Load a previous conversation file',
-                'category': '💬 Conversation',
-                'usage': '/load <filename>',
-                'example': '/load chat_history_20240101_120000.txt'
-            },
-            '/clear_history': {
-                'description': 'Clear conversation history',
-                'category': '💬 Conversation',
-                'usage': '/clear_history',
-                'example': '/clear_history'
-            },
-            '/export': {
-                'description': 'Export conversation as text file',
-                'category': '💬 Conversation',
-                'usage': '/export',
-                'example': '/export'
-            },
-            
-            # Information & Stats
-            '/stats': {
-                'description': 'Show conversation statistics',
-                'category': '📊 Information',
-                'usage': '/stats',
-                'example': '/stats'
-            },
-            '/time': {
-                'description': 'Show current time',
-                'category': '📊 Information',
-                'usage': '/time',
-                'example': '/time'
-            },
-            '/date': {
-                'description': 'Show current date',
-                'category': '📊 Information',
-                'usage': '/date',
-                'example': '/date'
-            },
-            '/info': {
-                'description': 'Show bot information',
-                'category': '📊 Information',
-                'usage': '/info',
-                'example': '/info'
-            },
-            
-            # Fun Commands
-            '/joke': {
-                'description': 'Tell me a random joke',
-                'category': '🎮 Fun',
-                'usage': '/joke',
-                'example': '/joke'
-            },
-            '/quote': {
-                'description': 'Get an inspirational quote',
-                'category': '🎮 Fun',
-                'usage': '/quote',
-                'example': '/quote'
-            },
-            '/fact': {
-                'description': 'Get a random fact',
-                'category': '🎮 Fun',
-                'usage': '/fact',
-                'example': '/fact'
-            },
-            '/roll': {
-                'description': 'Roll a dice (1-6)',
-                'category': '🎮 Fun',
-                'usage': '/roll',
-                'example': '/roll'
-            },
-            '/coin': {
-                'description': 'Flip a coin',
-                'category': '🎮 Fun',
-                'usage': '/coin',
-                'example': '/coin'
-            },
-            
-            # Utility Commands
-            '/search': {
-                'description': 'Search in conversation history',
-                'category': '🔧 Utility',
-                'usage': '/search <keyword>',
-                'example': '/search hello'
-            },
-            '/repeat': {
-                'description': 'Repeat last bot response',
-                'category': '🔧 Utility',
-                'usage': '/repeat',
-                'example': '/repeat'
-            },
-            '/count': {
-                'description': 'Count messages in history',
-                'category': '🔧 Utility',
-                'usage': '/count',
-                'example': '/count'
-            },
-            '/echo': {
-                'description': 'Echo your message',
-                'category': '🔧 Utility',
-                'usage': '/echo <message>',
-                'example': '/echo Hello World'
-            },
-            
-            # Exit
-            '/quit': {
-                'description': 'Exit the chatbot',
-                'category': '🚪 Exit',
-                'usage': '/quit',
-                'example': '/quit'
-            },
-            '/exit': {
-                'description': 'Exit the chatbot',
-                'category': '🚪 Exit',
-                'usage': '/exit',
-                'example': '/exit'
-            }
-        }
-        
-        # Define response patterns
-        self.responses = {
-            'greeting': {
-                'patterns': [r'hi', r'hello', r'hey', r'greetings', r'good morning', r'good afternoon', r'good evening'],
-                'responses': [
-                    f"Hello! I'm {name}. How can I help you?",
-                    f"Hi there! Nice to meet you!",
-                    f"Hey! What's on your mind?",
-                    f"Greetings! How are you today?"
-                ]
-            },
-            'how_are_you': {
-                'patterns': [r'how are you', r'how do you do', r'how\'s it going', r'how are things'],
-                'responses': [
-                    "I'm doing great, thanks for asking!",
-                    "I'm fantastic! How about you?",
-                    "Doing well, ready to chat with you!",
-                    "I'm good! Always happy to talk."
-                ]
-            },
-            'name': {
-                'patterns': [r'your name', r'who are you', r'what are you', r'tell me about yourself'],
-                'responses': [
-                    f"My name is {name}. I'm your personal chatbot assistant!",
-                    f"I'm {name}, created to chat with you and help where I can.",
-                    f"You can call me {name}. I'm here to keep you company!"
-                ]
-            },
-            'weather': {
-                'patterns': [r'weather', r'temperature', r'hot outside', r'cold outside'],
-                'responses': [
-                    "I wish I could tell you the weather! But I don't have internet access.",
-                    "Weather information requires an internet connection, which I don't have.",
-                    "Sorry, I can't check the weather right now. You might want to look outside! 😊"
-                ]
-            },
-            'thanks': {
-                'patterns': [r'thanks', r'thank you', r'appreciate it', r'good bot'],
-                'responses': [
-                    "You're welcome!",
-                    "Happy to help!",
-                    "Anytime!",
-                    "My pleasure!"
-                ]
-            },
-            'feeling': {
-                'patterns': [r'i am (.*)', r'i\'m (.*)', r'i feel (.*)', r'feeling (.*)'],
-                'responses': [
-                    "Thanks for sharing that with me.",
-                    "I understand how you feel.",
-                    "That's interesting. Tell me more.",
-                    "I see. How long have you felt that way?"
-                ]
-            },
-            'age': {
-                'patterns': [r'how old are you', r'your age'],
-                'responses': [
-                    "I'm brand new! Just created recently.",
-                    "I don't have an age like humans do. I'm just code!",
-                    "I'm as old as this conversation! 😊"
-                ]
-            },
-            'hobby': {
-                'patterns': [r'what do you like', r'your hobby', r'what do you do for fun'],
-                'responses': [
-                    "I love chatting with people like you!",
-                    "My favorite thing is having conversations and learning new things.",
-                    "I enjoy helping people and making them smile."
-                ]
-            },
-            'default': {
-                'patterns': [],
-                'responses': [
-                    "That's interesting! Tell me more.",
-                    "I see. What else is on your mind?",
-                    "Hmm, I'm not sure I understand fully. Could you explain?",
-                    "Interesting point! Go on...",
-                    "I'd love to hear more about that.",
-                    "That's a good conversation topic!"
-                ]
-            }
-        }
-        
-        # Collection of jokes
-        self.jokes = [
-            "Why don't scientists trust atoms? Because they make up everything!",
-            "What do you call a fake noodle? An impasta!",
-            "Why did the scarecrow win an award? He was outstanding in his field!",
-            "What do you call a bear with no teeth? A gummy bear!",
-            "Why don't eggs tell jokes? They'd crack each other up!",
-            "What do you call a sleeping bull? A bulldozer!",
-            "Why did the math book look sad? Because it had too many problems!",
-            "What do you call a fish with no eyes? A fsh!",
-            "Why don't skeletons fight each other? They don't have the guts!",
-            "What do you call a can opener that doesn't work? A can't opener!"
-        ]
-        
-        # Collection of inspirational quotes
-        self.quotes = [
-            "The only way to do great work is to love what you do. - Steve Jobs",
-            "Believe you can and you're halfway there. - Theodore Roosevelt",
-            "It does not matter how slowly you go as long as you do not stop. - Confucius",
-            "Everything you've ever wanted is on the other side of fear. - George Addair",
-            "The future belongs to those who believe in the beauty of their dreams. - Eleanor Roosevelt"
-        ]
+        self.fuzzy = fuzzy  # fall back to typo-tolerant matching before 'default' (can misfire, so opt-in)
+        self.classifier = classifier  # 'tfidf' scores intents before the regex matcher
+        self.word_boundaries = word_boundaries  # patterns only match whole words
+        # Each session draws from its own RNG, so a seed reproduces its replies
+        self.rng = random.Random(seed)
+        self.no_repeat = no_repeat  # cycle through responses, jokes etc. without repeats
+        self._cycles = {}  # choose() key -> ShuffleCycle
+        # thread_safe lets several threads share this bot: writes to the
+        # history, indexes and cycles take the lock, matching runs outside it,
+        # and stats, history and search read a snapshot taken under it
+        self.thread_safe = thread_safe
+        self._lock = threading.RLock() if thread_safe else contextlib.nullcontext()
+
+        self.metrics = metrics  # optional Metrics for per-stage timings
+        # With a HistoryDatabase every turn is stored there and history,
+        # search and stats are answered by queries; session resumes one
+        self.database = database
+        if database is not None:
+            self.conversation_history = SQLiteStore(database, name, session, max_history or 1000)
+        else:
+            self.conversation_history = ConversationStore(max_history, spill_path)
+        self.search_index = SearchIndex()
+        self.transcript_index = TranscriptIndex() if search_transcripts else None
+        self._file_index = None  # (path, TranscriptIndex) for the file last searched with /search --in
+        self.journal = journal  # TranscriptJournal that logs every turn, if any
         
-        # Collection of random facts
-        self.facts = [
-            "Honey never spoils. Archaeologists have found pots of honey in ancient Egyptian tombs that are over 3,000 years old and still perfectly edible!",
-            "A day on Venus is longer than a year on Venus. It takes 243 Earth days to rotate once but only 225 Earth days to orbit the sun.",
-            "Bananas are technically berries, while strawberries are not!",
-            "Octopuses have three hearts and blue blood!",
-            "The Eiffel Tower can be 15 cm taller during the summer due to thermal expansion!"
-        ]
+        # Intents, jokes, quotes, facts and the compiled matcher are shared;
+        # knowledge may also be a ContentLoader that hot-reloads them
+        self.knowledge = knowledge or KnowledgeBase.default()
+        if classifier is not None:
+            self.knowledge.classifier  # build it now rather than on the first message
 
-    def show_command_center(self):
-        """Display the command center with all available commands"""
-        print("\n" + "="*70)
-        print("🎮 COMMAND CENTER - All Available Commands")
-        print("="*70)
+    @property
+    def knowledge(self):
+        return self._knowledge.current()
+
+    @knowledge.setter
+    def knowledge(self, source):
+        self._knowledge = source
+
+    # Read-only views of the shared knowledge base
+    command_center = property(lambda self: self.commands.metadata)
+    responses = property(lambda self: self.knowledge.responses)
+    jokes = property(lambda self: self.knowledge.jokes)
+    quotes = property(lambda self: self.knowledge.quotes)
+    facts = property(lambda self: self.knowledge.facts)
+    matcher = property(lambda self: self.knowledge.token_matcher if self.word_boundaries
+                       else self.knowledge.matcher)
+
+    def add_intent(self, category, patterns, responses, examples=()):
+        """Add (or replace) an intent category for this bot only"""
+        self.knowledge = self.knowledge.with_intent(category, patterns, responses, examples)
+
+    def warm_up(self, background=False):
+        """Build the matcher and templates this bot uses now rather than on the first message
+
+        With background=True they are built in a daemon thread, which is
+        returned; a message that arrives first waits for the build to finish.
+        """
+        source = self._knowledge  # a ContentLoader also warms up the content it reloads
+
+        def build():
+            source.warm_up(self.fuzzy, self.word_boundaries, self.classifier is not None)
+
+        if not background:
+            build()
+            return None
+        thread = threading.Thread(target=build, name="warm-up", daemon=True)
+        thread.start()
+        return thread
+
+    def reseed(self, seed):
+        """Restart this session's RNG (and no-repeat cycles) from seed"""
+        self.rng.seed(seed)
+        self._cycles.clear()
+
+    def choose(self, key, items):
+        """Pick one of items with the session RNG; with no_repeat, cycle through them
+
+        key names the list (such as 'jokes') so each one keeps its own cycle.
+        A cycle restarts when the list itself changes, e.g. on content reload.
+        """
+        if not self.no_repeat:
+            return self.rng.choice(items)
+        with self._lock:
+            cycle = self._cycles.get(key)
+            if cycle is None or cycle.items is not items:
+                cycle = self._cycles[key] = ShuffleCycle(items)
+            return cycle.pick(self.rng)
+
+    def handle_command(self, user_input):
+        """Run a slash command; return (Command, reply), with Command None if unknown"""
+        metrics = self.metrics
+        if metrics is not None:
+            started = time.perf_counter()
+        command, argument = self.commands.split(user_input)
+        entry = self.commands.get(command)
+        if entry is None:
+            if metrics is not None:
+                metrics.count_command(command, known=False)
+            return None, f"❌ Unknown command '{command}'\nType '/commands' to see all available commands."
+        if entry.local_only and self.remote:
+            reply = f"❌ '{command}' is only available in a local session."
+        else:
+            reply = entry.handler(self, argument)
+        if metrics is not None:
+            metrics.count_command(entry.name)
+            metrics.observe('dispatch', time.perf_counter() - started)
+        return entry, reply
+
+    def respond(self, user_input):
+        """Return the reply to one line of input without printing (for non-interactive front ends)"""
+        return "".join(self.respond_chunks(user_input))
+
+    def respond_chunks(self, user_input):
+        """Like respond(), but yields long replies (such as /history) in chunks"""
+        user_input = user_input.strip()
+        if not user_input:
+            return ["👂 I'm listening... Say something!"]
+        if user_input.startswith('/'):
+            reply = self.handle_command(user_input)[1]
+            return [reply] if isinstance(reply, str) else reply
+        return [self.get_response(user_input)]
+
+    def render_command_center(self):
+        """The command center listing with all available commands, built once per registry"""
+        commands = self.commands
+        if commands.help_text is None:
+            commands.help_text = self._render_command_center()
+        return commands.help_text
+
+    def _render_command_center(self):
+        lines = ["\n" + "="*70, "🎮 COMMAND CENTER - All Available Commands", "="*70]
         
         # Group commands by category
         categories = {}
@@ -292,23 +2644,26 @@ class SimpleChatBot:
         
         # Display commands by category
         for category in sorted(categories.keys()):
-            print(f"\n{category}:")
-            print("-" * 50)
-            for cmd, info in sorted(categories[category]):
-                print(f"  {cmd:<15} - {info['description']}")
-                print(f"      📝 Usage: {info['usage']}")
+            lines.append(f"\n{category}:")
+            lines.append("-" * 50)
+            for cmd, info in sorted(categories[category], key=lambda item: item[0]):
+                lines.append(f"  {cmd:<15} - {info['description']}")
+                lines.append(f"      📝 Usage: {info['usage']}")
                 if info['example'] != info['usage']:
-                    print(f"      💡 Example: {info['example']}")
+                    lines.append(f"      💡 Example: {info['example']}")
         
-        print("\n" + "="*70)
-        print("💡 Tip: Type any command directly in the chat")
-        print("="*70 + "\n")
+        lines.append("\n" + "="*70)
+        lines.append("💡 Tip: Type any command directly in the chat")
+        lines.append("="*70 + "\n")
+        return "\n".join(lines)
 
-    def show_quick_commands(self):
-        """Show a quick reference of most used commands"""
-        print("\n" + "="*50)
-        print("⚡ QUICK COMMANDS REFERENCE")
-        print("="*50)
+    def show_command_center(self):
+        """Display the command center with all available commands"""
+        print(self.render_command_center())
+
+    def render_quick_commands(self):
+        """Build a quick reference of most used commands"""
+        lines = ["\n" + "="*50, "⚡ QUICK COMMANDS REFERENCE", "="*50]
         quick_commands = {
             '/help': 'Show all commands',
             '/history': 'View chat history',
@@ -320,12 +2675,24 @@ class SimpleChatBot:
             '/quit': 'Exit chatbot'
         }
         for cmd, desc in quick_commands.items():
-            print(f"{cmd:<12} - {desc}")
-        print("="*50 + "\n")
+            lines.append(f"{cmd:<12} - {desc}")
+        lines.append("="*50 + "\n")
+        return "\n".join(lines)
+
+    def show_quick_commands(self):
+        """Show a quick reference of most used commands"""
+        print(self.render_quick_commands())
 
     def clear_screen(self):
-        """Clear the console screen"""
-        os.system('cls' if os.name == 'nt' else 'clear')
+        """Clear the console screen
+
+        Writes the ANSI clear-screen and cursor-home sequences instead of
+        running cls/clear in a subprocess; output that isn't a terminal is
+        left alone.
+        """
+        if sys.stdout.isatty():
+            sys.stdout.write("\033[2J\033[H")
+            sys.stdout.flush()
 
     def get_time_response(self):
         """Generate current time response"""
@@ -339,15 +2706,15 @@ class SimpleChatBot:
 
     def get_joke(self):
         """Return a random joke"""
-        return f"😄 {random.choice(self.jokes)}"
+        return f"😄 {self.choose('jokes', self.jokes)}"
 
     def get_quote(self):
         """Return a random inspirational quote"""
-        return f"💫 {random.choice(self.quotes)}"
+        return f"💫 {self.choose('quotes', self.quotes)}"
 
     def get_fact(self):
         """Return a random fact"""
-        return f"🔍 Did you know? {random.choice(self.facts)}"
+        return f"🔍 Did you know? {self.choose('facts', self.facts)}"
 
     def get_bot_info(self):
         """Return bot information"""
@@ -361,89 +2728,366 @@ class SimpleChatBot:
         ]
         return "\n".join(info)
 
-    def search_history(self, keyword):
-        """Search for keyword in conversation history"""
+    def search_history(self, keyword, page=1, per_page=10, include_transcripts=False, path=None):
+        """Search conversation history (and optionally saved transcripts), newest first
+
+        With path, search that saved transcript or archive instead.
+        """
+        offset = (page - 1) * per_page
         results = []
-        for i, (speaker, message) in enumerate(self.conversation_history, 1):
-            if keyword.lower() in message.lower():
-                results.append(f"{i}. {speaker}: {message}")
-        
+        if path is not None:
+            with self._lock:
+                if self._file_index is None or self._file_index[0] != path:
+                    self._file_index = (path, TranscriptIndex(None, None))
+                index = self._file_index[1]
+                index.add_file(path)  # reindexed only if the file changed
+                found, has_more = index.search(keyword, per_page, offset)
+            results = [f"{speaker}: {message}" for _, speaker, message in found]
+        elif self.database is not None:
+            # Full-text query; with include_transcripts it covers every session
+            session = self.conversation_history.session
+            rows, has_more = self.database.search(keyword, per_page, offset,
+                                                  None if include_transcripts else session)
+            for found_in, seq, speaker, message in rows:
+                where = "" if found_in == session else f"[session {found_in}] "
+                results.append(f"{where}{seq + 1}. {speaker}: {message}")
+        else:
+            with self._lock:
+                doc_ids, has_more = self.search_index.search(keyword, per_page, offset,
+                                                             self.conversation_history.first_id)
+                for doc_id in doc_ids:
+                    turn = self.conversation_history.get(doc_id)
+                    if turn is not None:
+                        results.append(f"{doc_id + 1}. {turn.speaker}: {turn.message}")
+
+        if include_transcripts and self.transcript_index is not None:
+            with self._lock:
+                self.transcript_index.refresh()
+                found, more = self.transcript_index.search(keyword, per_page, offset)
+            has_more = has_more or more
+            for path, speaker, message in found:
+                results.append(f"[{path}] {speaker}: {message}")
+
+        note = ""
+        if include_transcripts and self.transcript_index is None and self.database is None:
+            note = "\n(Saved transcripts are not searched; start the bot with --search-transcripts.)"
         if results:
-            return f"Found {len(results)} matches:\n" + "\n".join(results[:10])  # Show first 10
+            header = f"Matches (page {page}):"
+            if has_more:
+                header += f" more on page {page + 1}"
+            return header + "\n" + "\n".join(results) + note
         else:
-            return f"No matches found for '{keyword}'"
+            return f"No matches found for '{keyword}'" + note
+
+    def load_conversation(self, filename, last=None):
+        """Replace the history with the turns of a saved transcript; return how many were loaded
+
+        With last=N only the final N turns are kept. The bot's own turns are
+        renamed to this bot's name so /repeat and /stats treat them as ours.
+        filename may also be an archive, and then only the blocks holding the
+        turns to load are decompressed.
+        """
+        if is_transcript_archive(filename):
+            with TranscriptArchive(filename) as archive:
+                start = 0 if last is None else max(0, len(archive) - last)
+                return self._load_turns(archive.bot_name, archive.iter_turns(start))
+        saved_name = transcript_bot_name(filename)
+        if saved_name is None:
+            raise ValueError("not a saved conversation (no transcript header)")
+        turns = iter_transcript(filename)
+        if last is not None:
+            turns = deque(turns, maxlen=last)
+        return self._load_turns(saved_name, turns)
+
+    def _load_turns(self, saved_name, turns):
+        # Read the whole file first, so one that fails part way leaves the history as it was
+        turns = list(turns)
+        with self._lock:
+            self.clear_history()
+            loaded = 0
+            for _, speaker, message in turns:
+                if speaker == saved_name:
+                    speaker = self.name
+                self._record(speaker, message)
+                loaded += 1
+        return loaded
+
+    def resume_session(self, session):
+        """Continue a session stored in the database; return how many turns it has"""
+        if self.database is None:
+            raise ValueError("no history database configured")
+        if not self.database.has_session(session):
+            raise ValueError(f"no session {session} in {self.database.path}")
+        with self._lock:
+            history = self.conversation_history
+            history.close()
+            self.conversation_history = SQLiteStore(self.database, self.name, session, history.max_turns)
+            return len(self.conversation_history)
+
+    def _record(self, speaker, message, intent=None):
+        """Append a turn to the history and keep the search index in step"""
+        history = self.conversation_history
+        turn_id = history.append(Turn(speaker, message), intent)
+        if self.database is None:
+            self.search_index.add(turn_id, message)  # the database has its own index
+        if self.journal is not None:
+            self.journal.append(speaker, message)
+        # Prune postings for spilled turns once per retention window
+        if history.max_turns and history.spilled and history.spilled % history.max_turns == 0:
+            self.search_index.discard_before(history.first_id)
+        return turn_id
+
+    def clear_history(self):
+        """Forget the conversation and its search index"""
+        with self._lock:
+            self.conversation_history.clear()
+            self.search_index.clear()
+            if self.journal is not None:
+                self.journal.rotate()
+
+    def _match_intent(self, knowledge, text, classify=True):
+        """(category, regex match or None) for lowercased text
 
-    def get_response(self, user_input):
-        """Process user input and return appropriate response"""
+        Tries the classifier, then the patterns, then fuzzy matching, then 'default'.
+        """
+        category = found = None
+        if classify and self.classifier is not None:
+            category = knowledge.classifier.classify(text)[0]
+        if category is None:
+            matcher = knowledge.token_matcher if self.word_boundaries else knowledge.matcher
+            priority, found = matcher.match_pattern(text)
+            if priority is not None:
+                category = matcher.categories[priority]
+        if category is None and self.fuzzy:
+            category = knowledge.fuzzy.match(text)[0]
+        return category or 'default', found
+
+    def match_intents(self, messages):
+        """Intent category for each message, scoring them in one batch with the classifier"""
+        knowledge = self.knowledge
+        lowered = [message.lower().strip() for message in messages]
+        if self.classifier is None:
+            return [self._match_intent(knowledge, text)[0] for text in lowered]
+        scored = knowledge.classifier.classify_batch(lowered)
+        return [category or self._match_intent(knowledge, text, classify=False)[0]
+                for text, (category, _) in zip(lowered, scored)]
+
+    def get_response(self, user_input, intent=None):
+        """Process user input and return appropriate response
+
+        intent skips matching when the category is already known (the batch
+        path scores whole chunks up front with match_intents()).
+        """
+        started = time.perf_counter()
+        metrics = self.metrics
         user_input_lower = user_input.lower().strip()
+        # Keyed on exactly what the matcher sees: patterns can depend on
+        # punctuation and spacing, so looser keys would mix up intents
+        key = user_input_lower
+        if metrics is not None:
+            mark = time.perf_counter()
+            metrics.observe('normalize', mark - started)
         
         # Add to conversation history
-        self.conversation_history.append(("You", user_input))
-        
-        # Check each category for matching patterns
-        for category, data in self.responses.items():
-            if category != 'default':
-                for pattern in data['patterns']:
-                    if re.search(pattern, user_input_lower):
-                        response = random.choice(data['responses'])
-                        self.conversation_history.append((self.name, response))
-                        return response
+        with self._lock:
+            turn_id = self._record("You", user_input)
+        if metrics is not None:
+            now = time.perf_counter()
+            metrics.observe('history_append', now - mark)
+            mark = now
         
-        # If no pattern matches, use default responses
-        response = random.choice(self.responses['default']['responses'])
-        self.conversation_history.append((self.name, response))
+        # Find the first matching category; fall back to default responses.
+        # Use one snapshot of the content in case it is reloaded meanwhile.
+        knowledge = self.knowledge
+        category = intent
+        found = None
+        if category is None:
+            # Each matching mode can answer differently, so keep their entries apart
+            if self.classifier is not None or self.word_boundaries or self.fuzzy:
+                key = (self.classifier, self.word_boundaries, self.fuzzy, key)
+            category = knowledge.intent_cache.get(key)
+        if category is None:
+            category, found = self._match_intent(knowledge, user_input_lower)
+            knowledge.intent_cache.put(key, category)
+        if metrics is not None:
+            now = time.perf_counter()
+            metrics.observe('match', now - mark)
+            metrics.count_intent(category)
+        # Slots come from the match just made, or (after a cache hit) a fresh search
+        slots = knowledge.extract_slots(category, user_input_lower, found, user_input.strip())
+        response = None
+        handler = self.intent_handlers.get(category)
+        if handler is not None:
+            response = handler(self, slots, user_input)
+        if response is None:
+            template = self.choose((category, bool(slots)), knowledge.templates_for(category, slots))
+            response = template.fill(self.name, slots)
+        if metrics is not None:
+            mark = time.perf_counter()
+        with self._lock:
+            if self.database is not None:
+                self.conversation_history.set_intent(turn_id, category)
+            self._record(self.name, response, category)
+            if metrics is not None:
+                metrics.observe('history_append', time.perf_counter() - mark)
+            self.conversation_history.stats.add_reply(category, time.perf_counter() - started)
         return response
 
     def save_conversation(self):
-        """Save conversation history to a file"""
+        """Save conversation history to a file (or checkpoint the journal)"""
+        if self.metrics is None:
+            return self._save_conversation()
+        started = time.perf_counter()
+        try:
+            return self._save_conversation()
+        finally:
+            self.metrics.observe('persist', time.perf_counter() - started)
+
+    def _save_conversation(self):
         try:
+            if self.journal is not None:
+                return self.journal.checkpoint(), True
+
             filename = f"chat_history_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}.txt"
             with open(filename, 'w', encoding='utf-8') as file:
-                file.write("=== Chat Conversation History ===\n")
-                file.write(f"Date: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n")
-                file.write(f"Bot: {self.name}\n")
-                file.write("=" * 40 + "\n\n")
+                write_transcript_header(file, self.name)
                 
-                for speaker, message in self.conversation_history:
+                written = 0  # dropped turns (max_history without a spill file) aren't written
+                for speaker, message in self.conversation_history.iter_all():
                     file.write(f"{speaker}: {message}\n")
+                    written += 1
                 
-                file.write("\n" + "=" * 40 + "\n")
-                file.write(f"Total Messages: {len(self.conversation_history)}")
+                write_transcript_footer(file, written)
             
+            if self.transcript_index is not None:
+                self.transcript_index.add_file(filename)
             return filename, True
         except Exception as e:
             return str(e), False
 
-    def show_history(self):
+    def export_archive(self, filename=None, codec=None):
+        """Write the whole conversation as a compressed archive; return (filename, success)"""
+        started = time.perf_counter()
+        try:
+            filename = filename or f"chat_history_{datetime.datetime.now().strftime('%Y%m%d_%H%M%S')}{ARCHIVE_SUFFIX}"
+            with self._lock, ArchiveWriter(filename, self.name, codec) as writer:
+                for speaker, message in self.conversation_history.iter_all():
+                    writer.append(speaker, message)
+            if self.transcript_index is not None:
+                self.transcript_index.add_file(filename)
+            return filename, True
+        except Exception as e:
+            return str(e), False
+        finally:
+            if self.metrics is not None:
+                self.metrics.observe('persist', time.perf_counter() - started)
+
+    HISTORY_PAGE_SIZE = 50
+
+    def iter_history(self, start=None, end=None, last=None, speaker=None, chunk_lines=200):
+        """Yield the conversation history listing as chunks of text
+
+        start and end are 1-based message numbers (inclusive), last keeps only
+        the newest N messages, and speaker keeps only that speaker's messages.
+        At most chunk_lines lines are held at a time.
+        """
+        history = self.conversation_history
+        total = len(history)
+        if not total:
+            yield "\n📝 No conversation history yet.\n"
+            return
+
+        yield "\n" + "="*50 + "\n📝 CONVERSATION HISTORY\n" + "="*50 + "\n"
+
+        if last is not None and speaker is not None:
+            # Newest-first scan, keeping at most `last` matching turns
+            picked = []
+            with self._lock:
+                for turn_id, turn in history.iter_newest():
+                    if turn.speaker == speaker:
+                        picked.append((turn_id, turn))
+                        if len(picked) >= last:
+                            break
+            turns = reversed(picked)
+        else:
+            if last is not None:
+                start, end = max(1, total - last + 1), total
+            start = max(1, start or 1)
+            end = min(end or total, total)
+            turns = history.iter_range(start - 1, end)
+            if self.thread_safe:
+                with self._lock:
+                    turns = list(turns)  # a snapshot, so writers can append meanwhile
+            if speaker is not None:
+                turns = ((turn_id, turn) for turn_id, turn in turns if turn.speaker == speaker)
+
+        lines = []
+        shown = 0
+        for turn_id, (who, message) in turns:
+            lines.append(f"{turn_id + 1:3d}. {who}: {message}")
+            shown += 1
+            if len(lines) >= chunk_lines:
+                yield "\n".join(lines) + "\n"
+                lines.clear()
+        if lines:
+            yield "\n".join(lines) + "\n"
+
+        footer = ["="*50, f"Total: {total} messages"]
+        if shown < total:
+            footer.append(f"Showing {shown} of them. More: /history <from>-<to>, --last N, "
+                          "--speaker <name>, --all")
+        yield "\n".join(footer) + "\n"
+
+    def show_history(self, start=None, end=None, last=None, speaker=None):
         """Display current conversation history"""
-        if not self.conversation_history:
-            return "\n📝 No conversation history yet."
-        
-        history = []
-        history.append("\n" + "="*50)
-        history.append("📝 CONVERSATION HISTORY")
-        history.append("="*50)
-        
-        for i, (speaker, message) in enumerate(self.conversation_history, 1):
-            history.append(f"{i:3d}. {speaker}: {message}")
-        
-        history.append("="*50)
-        history.append(f"Total: {len(self.conversation_history)} messages")
-        
-        return "\n".join(history)
+        return "".join(self.iter_history(start, end, last, speaker))
+
+    def _stats_snapshot(self):
+        """(total turns, ConversationStats) as of now; a copy when other threads may write"""
+        history = self.conversation_history
+        if not self.thread_safe:
+            return len(history), history.stats
+        with self._lock:
+            return len(history), history.stats.copy()
+
+    def get_stats(self):
+        """Return the running conversation statistics as a plain dict (e.g. for dashboards)"""
+        total_messages, running = self._stats_snapshot()
+        latency = running.latency
+        stats = {
+            'total_messages': total_messages,
+            'messages': dict(running.messages),
+            'words': dict(running.words),
+            'chars': dict(running.chars),
+            'intents': dict(running.intents),
+            'top_intents': running.top_intents(),
+            'latency_ms': {
+                'count': latency.count,
+                'mean': latency.mean * 1000,
+                'p50': latency.percentile(50) * 1000,
+                'p90': latency.percentile(90) * 1000,
+                'p99': latency.percentile(99) * 1000,
+                'max': latency.max * 1000,
+            },
+            'intent_cache': self.knowledge.intent_cache.info(),
+        }
+        if self.database is not None:
+            stats['session'] = self.conversation_history.session
+        return stats
 
     def show_stats(self):
         """Show conversation statistics"""
-        if not self.conversation_history:
+        total_messages, running = self._stats_snapshot()
+        if not total_messages:
             return "\n📊 No conversation statistics available."
         
-        user_messages = sum(1 for speaker, _ in self.conversation_history if speaker == "You")
-        bot_messages = sum(1 for speaker, _ in self.conversation_history if speaker == self.name)
-        total_messages = len(self.conversation_history)
+        user_messages = running.messages.get("You", 0)
+        bot_messages = running.messages.get(self.name, 0)
         
         # Calculate average message length
-        user_words = sum(len(message.split()) for speaker, message in self.conversation_history if speaker == "You")
-        bot_words = sum(len(message.split()) for speaker, message in self.conversation_history if speaker == self.name)
+        user_words = running.words.get("You", 0)
+        bot_words = running.words.get(self.name, 0)
+        user_chars = running.chars.get("You", 0)
         
         stats = []
         stats.append("\n" + "="*50)
@@ -454,13 +3098,261 @@ class SimpleChatBot:
         stats.append(f"{self.name}'s messages: {bot_messages}")
         stats.append(f"Your average words/message: {user_words/user_messages:.1f}" if user_messages > 0 else "Your average words/message: 0")
         stats.append(f"Bot average words/message: {bot_words/bot_messages:.1f}" if bot_messages > 0 else "Bot average words/message: 0")
+        stats.append(f"Your average characters/message: {user_chars/user_messages:.1f}" if user_messages > 0 else "Your average characters/message: 0")
         stats.append(f"Conversation turns: {total_messages // 2}")
+        if running.intents:
+            stats.append("-"*50)
+            stats.append("Top intents:")
+            answered = sum(running.intents.values())
+            for category, hits in running.top_intents():
+                stats.append(f"  {category:<15} {hits:>6}  ({hits / answered:.0%})")
+            latency = running.latency
+            if latency.count:  # timings aren't stored, so a resumed session starts without them
+                stats.append(f"Response time: p50 {latency.percentile(50) * 1000:.2f} ms, "
+                             f"p90 {latency.percentile(90) * 1000:.2f} ms, "
+                             f"p99 {latency.percentile(99) * 1000:.2f} ms")
         stats.append("="*50)
         
         return "\n".join(stats)
 
-    def chat(self):
-        """Main chat loop"""
+    def show_database_stats(self):
+        """Show statistics for every session in the history database"""
+        database = self.database
+        totals = database.speaker_totals()
+        intents = database.intent_counts()
+        stats = ["\n" + "="*50, "📊 ALL SESSIONS", "="*50,
+                 f"Database: {database.path}",
+                 f"Sessions: {database.session_count()}",
+                 f"Total messages: {sum(messages for messages, _, _ in totals.values())}"]
+        for speaker, (messages, words, chars) in sorted(totals.items(), key=lambda item: -item[1][0]):
+            stats.append(f"  {speaker:<15} {messages:>8} messages, {words / messages:.1f} words/message")
+        if intents:
+            stats.append("-"*50)
+            stats.append("Top intents:")
+            for category, hits in heapq.nlargest(5, intents.items(), key=lambda item: item[1]):
+                stats.append(f"  {category:<15} {hits:>8}")
+        stats.append("="*50)
+        return "\n".join(stats)
+
+    # ---- Command handlers -------------------------------------------------
+    # Each handler takes the text after the command and returns the reply.
+
+    @commands.command('/help', 'Show all available commands', '📋 General', panel=True)
+    def cmd_help(self, argument):
+        return self.render_command_center()
+
+    @commands.command('/commands', 'Show command center (this menu)', '📋 General', panel=True)
+    def cmd_commands(self, argument):
+        return self.render_command_center()
+
+    @commands.command('/quick', 'Show the most used commands', '📋 General', hidden=True, panel=True)
+    def cmd_quick(self, argument):
+        return self.render_quick_commands()
+
+    @commands.command('/clear', 'Clear the screen', '📋 General')
+    def cmd_clear(self, argument):
+        if self.interactive:
+            self.clear_screen()
+        return "Screen cleared! Ready to continue...\n"
+
+    @commands.command('/history', 'Show conversation history', '💬 Conversation', panel=True,
+                      usage='/history [<from>-<to> | --last N | --all] [--speaker <name>]',
+                      example='/history 500-600')
+    def cmd_history(self, argument):
+        usage = "Usage: /history [<from>-<to> | --last N | --all] [--speaker <name>]"
+        words = argument.split()
+        start = end = speaker = None
+        last = self.HISTORY_PAGE_SIZE
+        while words:
+            word = words.pop(0)
+            if word == '--all':
+                last = None
+            elif word == '--last' and words and words[0].isdigit():
+                last = int(words.pop(0))
+            elif word == '--speaker' and words:
+                speaker = words.pop(0)
+            elif re.fullmatch(r'\d+-\d+', word):
+                start, end = (int(n) for n in word.split('-'))
+                last = None
+            elif word.isdigit():
+                start = end = int(word)
+                last = None
+            else:
+                return usage
+        return self.iter_history(start, end, last, speaker)
+
+    @commands.command('/save', 'Save conversation to file', '💬 Conversation', local_only=True)
+    def cmd_save(self, argument):
+        filename, success = self.save_conversation()
+        if success:
+            return f"✅ Conversation saved to '{filename}'"
+        return f"❌ Error saving: {filename}"
+
+    @commands.command('/load', 'Load a previous conversation file', '💬 Conversation',
+                      usage='/load <filename> [--last N] | --session <id>',
+                      example='/load chat_history_20240101_120000.txt --last 100', local_only=True)
+    def cmd_load(self, argument):
+        words = argument.split()
+        if words[:1] == ['--session']:
+            if len(words) != 2 or not words[1].isdigit():
+                return "Usage: /load --session <id>"
+            try:
+                turns = self.resume_session(int(words[1]))
+            except ValueError as e:
+                return f"❌ {e}"
+            return f"✅ Resumed session {words[1]} ({turns} messages)"
+        last = None
+        if '--last' in words:
+            at = words.index('--last')
+            if at + 1 >= len(words) or not words[at + 1].isdigit():
+                return "Usage: /load <filename> [--last N]"
+            last = int(words[at + 1])
+            del words[at:at + 2]
+        if not words:
+            return "Please specify filename. Usage: /load <filename>"
+        filename = " ".join(words)
+        try:
+            loaded = self.load_conversation(filename, last)
+        except (OSError, ValueError, RuntimeError) as e:
+            return f"❌ Error loading '{filename}': {e}"
+        return f"✅ Loaded {loaded} messages from '{filename}'"
+
+    @commands.command('/clear_history', 'Clear conversation history', '💬 Conversation')
+    def cmd_clear_history(self, argument):
+        self.clear_history()
+        return "✅ Conversation history cleared!"
+
+    @commands.command('/export', 'Export conversation as a text file or compressed archive', '💬 Conversation',
+                      usage='/export [--archive]', example='/export --archive', local_only=True)
+    def cmd_export(self, argument):
+        if argument == '--archive':
+            filename, success = self.export_archive()
+        elif argument:
+            return "Usage: /export [--archive]"
+        else:
+            filename, success = self.save_conversation()
+        if success:
+            return f"✅ Conversation exported to '{filename}'"
+        return f"❌ Error exporting: {filename}"
+
+    @commands.command('/stats', 'Show conversation statistics', '📊 Information', panel=True,
+                      usage='/stats [--json | --all]', example='/stats --json')
+    def cmd_stats(self, argument):
+        if argument == '--json':
+            return json.dumps(self.get_stats(), ensure_ascii=False)
+        if argument == '--all':
+            if self.database is None:
+                return "--all needs a history database (start with --db)"
+            return self.show_database_stats()
+        return self.show_stats()
+
+    @commands.command('/time', 'Show current time', '📊 Information')
+    def cmd_time(self, argument):
+        return self.get_time_response()
+
+    @commands.command('/date', 'Show current date', '📊 Information')
+    def cmd_date(self, argument):
+        return self.get_date_response()
+
+    @commands.command('/info', 'Show bot information', '📊 Information')
+    def cmd_info(self, argument):
+        return "\n" + self.get_bot_info()
+
+    @commands.command('/joke', 'Tell me a random joke', '🎮 Fun')
+    def cmd_joke(self, argument):
+        return self.get_joke()
+
+    @commands.command('/quote', 'Get an inspirational quote', '🎮 Fun')
+    def cmd_quote(self, argument):
+        return self.get_quote()
+
+    @commands.command('/fact', 'Get a random fact', '🎮 Fun')
+    def cmd_fact(self, argument):
+        return self.get_fact()
+
+    @commands.command('/roll', 'Roll a dice (1-6)', '🎮 Fun')
+    def cmd_roll(self, argument):
+        roll = self.rng.randint(1, 6)
+        return f"🎲 You rolled a {roll}!"
+
+    @commands.command('/coin', 'Flip a coin', '🎮 Fun')
+    def cmd_coin(self, argument):
+        result = self.rng.choice(['Heads', 'Tails'])
+        return f"🪙 It's {result}!"
+
+    @commands.command('/search', 'Search in conversation history', '🔧 Utility',
+                      usage='/search <words> [word*] [--page N] [--all | --in FILE]',
+                      example='/search hello wor* --page 2')
+    def cmd_search(self, argument):
+        words = argument.split()
+        page = 1
+        path = None
+        include_transcripts = '--all' in words
+        if '--page' in words:
+            at = words.index('--page')
+            if at + 1 < len(words) and words[at + 1].isdigit():
+                page = max(1, int(words[at + 1]))
+                del words[at:at + 2]
+        if '--in' in words:
+            at = words.index('--in')
+            if at + 1 >= len(words):
+                return "Usage: /search <words> --in <transcript or archive>"
+            path = words[at + 1]
+            del words[at:at + 2]
+        words = [w for w in words if w != '--all']
+        if not words:
+            return "Please provide a keyword. Usage: /search <keyword>"
+        keyword = " ".join(words)
+        if self.remote and (path is not None or include_transcripts):
+            # Both read other files or sessions than this one's
+            return "❌ --in and --all are only available in a local session."
+        if path is None:
+            return self.search_history(keyword, page, include_transcripts=include_transcripts)
+        try:
+            return self.search_history(keyword, page, path=path)
+        except (OSError, ValueError, RuntimeError) as e:
+            return f"❌ Error searching '{path}': {e}"
+
+    @commands.command('/metrics', 'Show performance metrics (Prometheus format)', '📊 Information', panel=True)
+    def cmd_metrics(self, argument):
+        if self.metrics is None:
+            return "\n📈 Metrics are disabled. Start the bot with --metrics to collect them."
+        return self.metrics.render()
+
+    @commands.command('/repeat', 'Repeat last bot response', '🔧 Utility')
+    def cmd_repeat(self, argument):
+        last_bot_msg = self.conversation_history.last_message(self.name)
+        if last_bot_msg:
+            return f"[Repeated] {last_bot_msg}"
+        return "No previous message to repeat."
+
+    @commands.command('/count', 'Count messages in history', '🔧 Utility')
+    def cmd_count(self, argument):
+        return f"📊 Total messages: {len(self.conversation_history)}"
+
+    @commands.command('/echo', 'Echo your message', '🔧 Utility',
+                      usage='/echo <message>', example='/echo Hello World')
+    def cmd_echo(self, argument):
+        if argument:
+            return f"Echo: {argument}"
+        return "Nothing to echo. Usage: /echo <message>"
+
+    @commands.command('/quit', 'Exit the chatbot', '🚪 Exit', exits=True)
+    def cmd_quit(self, argument):
+        return "👋 Goodbye! Thanks for chatting!"
+
+    @commands.command('/exit', 'Exit the chatbot', '🚪 Exit', exits=True)
+    def cmd_exit(self, argument):
+        return "👋 Goodbye! Thanks for chatting!"
+
+    def chat(self, startup=None):
+        """Main chat loop
+
+        startup is an optional StartupProfile, reported just before the first prompt.
+        """
+        self.interactive = True
+        # Compile the matcher while the banner prints and the user types
+        self.warm_up(background=True)
         self.clear_screen()
         print("\n" + "="*70)
         print(f"🤖 WELCOME TO {self.name.upper()}'S CHATBOT!")
@@ -471,120 +3363,33 @@ class SimpleChatBot:
         print("   • Type '/quick' for most used commands")
         print("   • Just chat naturally with me!")
         print("="*70 + "\n")
+        if startup is not None:
+            startup.mark("banner")
+            startup.report()
 
         while True:
             try:
                 user_input = input("You: ").strip()
                 
-                # Handle commands
+                # Handle commands through the registry
                 if user_input.startswith('/'):
-                    command = user_input.lower().split()[0]  # Get first part of command
-                    
-                    # Command Center
-                    if command == '/commands' or command == '/help':
-                        self.show_command_center()
-                    
-                    elif command == '/quick':
-                        self.show_quick_commands()
-                    
-                    elif command == '/clear':
-                        self.clear_screen()
-                        print(f"\n{self.name}: Screen cleared! Ready to continue...\n")
-                    
-                    # Conversation Management
-                    elif command == '/history':
-                        print(self.show_history())
-                    
-                    elif command == '/save':
-                        filename, success = self.save_conversation()
-                        if success:
-                            print(f"\n{self.name}: ✅ Conversation saved to '{filename}'")
-                        else:
-                            print(f"\n{self.name}: ❌ Error saving: {filename}")
-                    
-                    elif command == '/load':
-                        parts = user_input.split()
-                        if len(parts) > 1:
-                            filename = parts[1]
-                            # Here you would implement load functionality
-                            print(f"\n{self.name}: Loading '{filename}'... (feature in development)")
-                        else:
-                            print(f"\n{self.name}: Please specify filename. Usage: /load <filename>")
-                    
-                    elif command == '/clear_history':
-                        self.conversation_history.clear()
-                        print(f"\n{self.name}: ✅ Conversation history cleared!")
-                    
-                    elif command == '/export':
-                        filename, success = self.save_conversation()
-                        if success:
-                            print(f"\n{self.name}: ✅ Conversation exported to '{filename}'")
-                    
-                    # Information & Stats
-                    elif command == '/stats':
-                        print(self.show_stats())
-                    
-                    elif command == '/time':
-                        print(f"\n{self.name}: {self.get_time_response()}")
-                    
-                    elif command == '/date':
-                        print(f"\n{self.name}: {self.get_date_response()}")
-                    
-                    elif command == '/info':
-                        print(f"\n{self.name}:\n{self.get_bot_info()}")
-                    
-                    # Fun Commands
-                    elif command == '/joke':
-                        print(f"\n{self.name}: {self.get_joke()}")
-                    
-                    elif command == '/quote':
-                        print(f"\n{self.name}: {self.get_quote()}")
-                    
-                    elif command == '/fact':
-                        print(f"\n{self.name}: {self.get_fact()}")
-                    
-                    elif command == '/roll':
-                        roll = random.randint(1, 6)
-                        print(f"\n{self.name}: 🎲 You rolled a {roll}!")
-                    
-                    elif command == '/coin':
-                        result = random.choice(['Heads', 'Tails'])
-                        print(f"\n{self.name}: 🪙 It's {result}!")
-                    
-                    # Utility Commands
-                    elif command == '/search':
-                        parts = user_input.split(maxsplit=1)
-                        if len(parts) > 1:
-                            results = self.search_history(parts[1])
-                            print(f"\n{self.name}: {results}")
-                        else:
-                            print(f"\n{self.name}: Please provide a keyword. Usage: /search <keyword>")
-                    
-                    elif command == '/repeat':
-                        # Find last bot message
-                        last_bot_msg = None
-                        for speaker, msg in reversed(self.conversation_history):
-                            if speaker == self.name:
-                                last_bot_msg = msg
-                                break
-                        if last_bot_msg:
-                            print(f"\n{self.name}: [Repeated] {last_bot_msg}")
-                        else:
-                            print(f"\n{self.name}: No previous message to repeat.")
-                    
-                    elif command == '/count':
-                        print(f"\n{self.name}: 📊 Total messages: {len(self.conversation_history)}")
-                    
-                    elif command == '/echo':
-                        parts = user_input.split(maxsplit=1)
-                        if len(parts) > 1:
-                            print(f"\n{self.name}: Echo: {parts[1]}")
-                        else:
-                            print(f"\n{self.name}: Nothing to echo. Usage: /echo <message>")
-                    
-                    # Exit Commands
-                    elif command in ['/quit', '/exit']:
-                        print(f"\n{self.name}: 👋 Goodbye! Thanks for chatting!")
+                    entry, reply = self.handle_command(user_input)
+                    if entry is None:
+                        first, rest = reply.split("\n", 1)
+                        print(f"\n{self.name}: {first}")
+                        print(f"{self.name}: {rest}")
+                    elif not isinstance(reply, str):
+                        # Streamed reply: write it chunk by chunk
+                        for chunk in reply:
+                            sys.stdout.write(chunk)
+                        sys.stdout.write("\n")
+                        sys.stdout.flush()
+                    elif entry.panel:
+                        print(reply)
+                    else:
+                        print(f"\n{self.name}: {reply}")
+
+                    if entry is not None and entry.exits:
                         if len(self.conversation_history) > 0:
                             save_choice = input(f"\n{self.name}: Save conversation before exiting? (yes/no): ").strip().lower()
                             if save_choice in ['yes', 'y']:
@@ -593,11 +3398,6 @@ class SimpleChatBot:
                                     print(f"{self.name}: ✅ Saved to '{filename}'")
                         print(f"\n{self.name}: Have a great day!")
                         break
-                    
-                    else:
-                        print(f"\n{self.name}: ❌ Unknown command '{command}'")
-                        print(f"{self.name}: Type '/commands' to see all available commands.")
-                    
                     continue
 
                 # Handle empty input
@@ -609,16 +3409,405 @@ class SimpleChatBot:
                 response = self.get_response(user_input)
                 print(f"\n{self.name}: {response}\n")
 
-            except KeyboardInterrupt:
+            except (KeyboardInterrupt, EOFError):
+                # Ctrl+C, or the end of piped input
                 print(f"\n\n{self.name}: 👋 Goodbye! Thanks for chatting!")
                 break
             except Exception as e:
                 print(f"\n{self.name}: ❌ Oops! Something went wrong: {e}")
                 print(f"{self.name}: Let's continue chatting!\n")
 
+        if self.journal is not None:
+            self.journal.close()
+        self.conversation_history.close()
+
+class ChatServer:
+    """Serve many chat sessions from one process over a line-based protocol
+
+    Every line a client sends is one message or command. Each reply is sent as
+    its text lines followed by a line holding a single "." (reply lines that
+    start with "." get an extra "." in front, as in SMTP). Sessions share one
+    knowledge base and each one gets its own history.
+    """
+
+    def __init__(self, name="ChatBuddy", max_history=1000, knowledge=None, metrics=None, classifier=None,
+                 word_boundaries=False, database=None, seed=None, no_repeat=False, fuzzy=False):
+        self.name = name
+        self.seed = seed  # session N gets the seed "<seed>:<N>"
+        self.no_repeat = no_repeat
+        self.database = database  # HistoryDatabase every session stores its turns in
+        self.knowledge = knowledge or KnowledgeBase.default()
+        self.metrics = metrics  # shared by every session
+        self.classifier = classifier
+        self.word_boundaries = word_boundaries
+        self.fuzzy = fuzzy
+        # Build once before the first session (and, with a ContentLoader, after every reload)
+        self.knowledge.warm_up(fuzzy, word_boundaries, classifier is not None)
+        self.max_history = max_history
+        self.active_sessions = 0
+        self.total_sessions = 0
+
+    @staticmethod
+    def frame(reply, end=True):
+        """Encode a reply (or, with end=False, one chunk of it) for the wire"""
+        lines = [("." + line) if line.startswith(".") else line
+                 for line in reply.strip("\n").split("\n")]
+        if end:
+            lines.append(".")
+        return ("\n".join(lines) + "\n").encode('utf-8')
+
+    async def handle_session(self, reader, writer):
+        """Run one client session until it quits or disconnects"""
+        import asyncio
+        bot = SimpleChatBot(self.name, self.max_history, knowledge=self.knowledge, metrics=self.metrics,
+                            classifier=self.classifier, word_boundaries=self.word_boundaries, fuzzy=self.fuzzy,
+                            database=self.database, no_repeat=self.no_repeat,
+                            seed=None if self.seed is None else f"{self.seed}:{self.total_sessions}")
+        bot.remote = True  # no file access for network clients
+        self.active_sessions += 1
+        self.total_sessions += 1
+        try:
+            writer.write(self.frame(f"🤖 Hi! I'm {bot.name}. Type /quit to leave."))
+            await writer.drain()
+            while True:
+                try:
+                    line = await reader.readline()
+                except (asyncio.LimitOverrunError, ValueError):
+                    writer.write(self.frame("❌ Message too long."))
+                    break
+                if not line:
+                    break
+                text = line.decode('utf-8', 'replace').strip()
+                entry = bot.commands.get(bot.commands.split(text)[0]) if text.startswith('/') else None
+                try:
+                    for chunk in bot.respond_chunks(text):
+                        writer.write(self.frame(chunk, end=False))
+                        await writer.drain()
+                except Exception as e:
+                    writer.write(self.frame(f"❌ Oops! Something went wrong: {e}", end=False))
+                writer.write(b".\n")
+                if entry is not None and entry.exits:
+                    break
+                await writer.drain()
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            self.active_sessions -= 1
+            bot.conversation_history.close()
+            writer.close()
+
+    async def handle_metrics(self, reader, writer):
+        """Answer one HTTP request with the metrics text (for Prometheus scrapes)"""
+        try:
+            request = await reader.readline()
+            while (await reader.readline()).strip():
+                pass  # skip headers
+            parts = request.decode('latin-1').split()
+            if len(parts) >= 2 and parts[0] == 'GET' and parts[1].split('?')[0] in ('/', '/metrics'):
+                body = self.metrics.render().encode('utf-8')
+                lines = [b"HTTP/1.1 200 OK",
+                         b"Content-Type: text/plain; version=0.0.4; charset=utf-8"]
+            else:
+                body = b"not found\n"
+                lines = [b"HTTP/1.1 404 Not Found", b"Content-Type: text/plain"]
+            lines.append(b"Content-Length: " + str(len(body)).encode())
+            lines.append(b"Connection: close")
+            writer.write(b"\r\n".join(lines) + b"\r\n\r\n" + body)
+            await writer.drain()
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def serve(self, host="127.0.0.1", port=8765, unix_path=None, metrics_port=None):
+        """Accept connections on a TCP port or a Unix socket until cancelled"""
+        import asyncio  # only the server needs it, so plain chat starts without it
+        if metrics_port is not None:
+            if self.metrics is None:
+                self.metrics = Metrics()
+            metrics_server = await asyncio.start_server(self.handle_metrics, host, metrics_port)
+            print(f"📈 Metrics on http://{host}:{metrics_port}/metrics")
+            asyncio.get_running_loop().create_task(metrics_server.serve_forever())
+        if unix_path:
+            server = await asyncio.start_unix_server(self.handle_session, path=unix_path)
+            where = unix_path
+        else:
+            server = await asyncio.start_server(self.handle_session, host, port)
+            where = f"{host}:{port}"
+        print(f"🤖 {self.name} serving on {where}")
+        async with server:
+            await server.serve_forever()
+
+
+def iter_batch_input(stream, jsonl=False):
+    """Yield (line_number, message, error) for each non-blank input line
+
+    JSONL lines may be a bare string or an object with a "message" (or "input")
+    field.
+    """
+    for line_number, line in enumerate(stream, 1):
+        line = line.strip()
+        if not line:
+            continue
+        if not jsonl:
+            yield line_number, line, None
+            continue
+        try:
+            record = json.loads(line)
+            if isinstance(record, dict):
+                record = record.get('message', record.get('input'))
+            if not isinstance(record, str):
+                raise ValueError("expected a string or an object with a 'message' field")
+            yield line_number, record, None
+        except ValueError as e:
+            yield line_number, None, str(e)
+
+
+_batch_bot = None
+
+
+def _batch_worker_init(name, content=None, classifier=None, word_boundaries=False, no_repeat=False, fuzzy=False):
+    """Build the per-process bot once when a batch worker starts"""
+    global _batch_bot
+    knowledge = KnowledgeBase.from_file(content) if content else None
+    _batch_bot = SimpleChatBot(name, knowledge=knowledge, classifier=classifier, word_boundaries=word_boundaries,
+                               no_repeat=no_repeat, fuzzy=fuzzy)
+
+
+def _batch_run_chunk(chunk_no, items, seed):
+    """Answer one chunk of batch input, returning its JSONL output lines
+
+    Every chunk starts from an empty history and, with a seed, from the bot's
+    RNG reseeded by (seed, chunk_no), so output does not depend on which
+    worker ran it.
+    """
+    bot = _batch_bot
+    bot.clear_history()
+    if seed is not None:
+        bot.reseed(f"{seed}:{chunk_no}")
+    # With a classifier, score every plain message of the chunk in one batch
+    intents = {}
+    if bot.classifier is not None:
+        plain = [i for i, (_, message, error) in enumerate(items)
+                 if error is None and message.strip() and not message.strip().startswith('/')]
+        intents = dict(zip(plain, bot.match_intents([items[i][1] for i in plain])))
+    out = []
+    for i, (line_number, message, error) in enumerate(items):
+        if error is not None:
+            record = {'line': line_number, 'error': error}
+        else:
+            try:
+                if i in intents:
+                    response = bot.get_response(message.strip(), intents[i])
+                else:
+                    response = bot.respond(message)
+                record = {'line': line_number, 'input': message, 'response': response}
+            except Exception as e:
+                record = {'line': line_number, 'input': message, 'error': str(e)}
+        out.append(json.dumps(record, ensure_ascii=False))
+    return out
+
+
+class BatchRunner:
+    """Stream messages through the bot and write one JSON response per line
+
+    Input is read lazily in chunks and at most a few chunks per worker are in
+    flight at once, so memory stays flat however long the input is.
+    """
+
+    def __init__(self, name="ChatBuddy", workers=1, seed=None, chunk_size=1000, content=None, classifier=None,
+                 word_boundaries=False, no_repeat=False, fuzzy=False):
+        self.name = name
+        self.content = content
+        self.bot_options = (classifier, word_boundaries, no_repeat, fuzzy)
+        self.workers = max(1, workers)
+        self.seed = seed
+        self.chunk_size = chunk_size
+
+    def _chunks(self, stream, jsonl):
+        items = iter_batch_input(stream, jsonl)
+        for chunk_no in itertools.count():
+            chunk = list(itertools.islice(items, self.chunk_size))
+            if not chunk:
+                return
+            yield chunk_no, chunk
+
+    def run(self, instream, outstream, jsonl=False):
+        """Process every line of instream; return the number of lines answered"""
+        answered = 0
+        chunks = self._chunks(instream, jsonl)
+        if self.workers == 1:
+            _batch_worker_init(self.name, self.content, *self.bot_options)
+            for chunk_no, chunk in chunks:
+                outstream.write("\n".join(_batch_run_chunk(chunk_no, chunk, self.seed)) + "\n")
+                answered += len(chunk)
+            return answered
+
+        import multiprocessing
+        init_args = (self.name, self.content) + self.bot_options
+        with multiprocessing.Pool(self.workers, _batch_worker_init, init_args) as pool:
+            pending = deque()
+            for chunk_no, chunk in chunks:
+                pending.append((len(chunk), pool.apply_async(_batch_run_chunk, (chunk_no, chunk, self.seed))))
+                # Bound the work in flight; results are written in input order
+                while len(pending) >= self.workers * 2:
+                    count, result = pending.popleft()
+                    outstream.write("\n".join(result.get()) + "\n")
+                    answered += count
+            while pending:
+                count, result = pending.popleft()
+                outstream.write("\n".join(result.get()) + "\n")
+                answered += count
+        return answered
+
+
+class StartupProfile:
+    """Time the steps from importing this module to the first prompt (--profile-startup)
+
+    Each mark() closes the step since the previous mark; report() prints the
+    steps and the total on stderr, so scripted runs can keep it apart from the
+    conversation. Interpreter start-up before the import is not included.
+    """
+
+    def __init__(self, started=STARTED):
+        self.started = started
+        self.marks = []  # (step, perf_counter() when it ended)
+        self.notes = []  # extra lines printed after the timings
+
+    def mark(self, step):
+        self.marks.append((step, time.perf_counter()))
+
+    def report(self, file=None):
+        steps = []
+        previous = self.started
+        for step, ended in self.marks:
+            steps.append(f"{step} {(ended - previous) * 1000:.1f} ms")
+            previous = ended
+        lines = [f"⏱️ Startup: {(previous - self.started) * 1000:.1f} ms to first prompt ({', '.join(steps)})"]
+        lines.extend(f"   {note}" for note in self.notes)
+        print("\n".join(lines), file=file or sys.stderr, flush=True)
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Simple command-driven chatbot")
+    parser.add_argument('--name', default="ChatBuddy", help="bot name")
+    parser.add_argument('--content', metavar='FILE',
+                        help="load intents, jokes, quotes and facts from a JSON/YAML file")
+    parser.add_argument('--reload-interval', type=float, default=2.0,
+                        help="seconds between checks for --content changes")
+    parser.add_argument('--dump-content', metavar='FILE',
+                        help="write the built-in content as JSON (a starting point for --content) and exit")
+    parser.add_argument('--classifier', choices=['tfidf'],
+                        help="score intents with an offline TF-IDF classifier (needs NumPy) before the patterns")
+    parser.add_argument('--word-boundaries', action='store_true',
+                        help="only match intent patterns on whole words (\"hi\" no longer matches \"this\")")
+    parser.add_argument('--fuzzy', action='store_true',
+                        help="answer near-misses of intent phrases (typos) instead of falling back to the default reply")
+    parser.add_argument('--serve', action='store_true', help="run the multi-session asyncio server")
+    parser.add_argument('--host', default="127.0.0.1", help="address to listen on with --serve")
+    parser.add_argument('--port', type=int, default=8765, help="TCP port to listen on with --serve")
+    parser.add_argument('--unix', metavar='PATH', help="listen on a Unix socket instead of TCP")
+    parser.add_argument('--metrics', action='store_true', help="collect per-stage timings for /metrics")
+    parser.add_argument('--metrics-port', type=int, metavar='PORT',
+                        help="with --serve, expose Prometheus metrics over HTTP on this port")
+    parser.add_argument('--max-history', type=int,
+                        help="turns kept in memory (per session with --serve, default 1000 there; unlimited otherwise)")
+    parser.add_argument('--spill', metavar='PATH',
+                        help="with --max-history, write turns that leave memory to this new file instead of dropping them")
+    parser.add_argument('--db', metavar='PATH',
+                        help="store every turn in a SQLite database; /history, /search, /stats and /load query it")
+    parser.add_argument('--session', type=int, metavar='ID', help="with --db, resume this session")
+    parser.add_argument('--search-transcripts', action='store_true',
+                        help="let /search --all look through saved chat_history_* transcripts and archives too")
+    parser.add_argument('--journal', nargs='?', const='', metavar='PATH',
+                        help="append every turn to a session log as it happens")
+    parser.add_argument('--fsync', choices=TranscriptJournal.FSYNC_POLICIES, default='checkpoint',
+                        help="when the journal is fsynced")
+    parser.add_argument('--journal-max-bytes', type=int, default=10 * 1024 * 1024,
+                        help="rotate the journal once a segment reaches this size")
+    parser.add_argument('--batch', action='store_true',
+                        help="answer newline-delimited messages from --input and write JSONL")
+    parser.add_argument('--input', metavar='FILE', help="batch input file (default: stdin)")
+    parser.add_argument('--output', metavar='FILE', help="batch output file (default: stdout)")
+    parser.add_argument('--jsonl', action='store_true', help="batch input is JSONL instead of plain lines")
+    parser.add_argument('--workers', type=int, default=1, help="batch worker processes")
+    parser.add_argument('--seed', type=int,
+                        help="seed for reproducible replies (batch chunks and server sessions derive theirs from it)")
+    parser.add_argument('--no-repeat', action='store_true',
+                        help="cycle through responses, jokes, quotes and facts instead of drawing with repeats")
+    parser.add_argument('--chunk-size', type=int, default=1000, help="messages per batch chunk")
+    parser.add_argument('--convert-transcripts', nargs='*', metavar='FILE',
+                        help="convert saved transcripts (default: chat_history_*.txt) to compressed archives and exit")
+    parser.add_argument('--profile-startup', action='store_true',
+                        help="print the time from import to the first chat prompt on stderr")
+    args = parser.parse_args(argv)
+    if args.db and args.batch:
+        parser.error("--db can't be used with --batch")
+    if args.session is not None and (not args.db or args.serve):
+        parser.error("--session needs --db and an interactive session")
+    return args
+
+
 # Run the chatbot
 if __name__ == "__main__":
-    # You can change the bot's name here
-    bot_name = "ChatBuddy"
-    bot = SimpleChatBot(bot_name)
-    bot.chat()
\ No newline at end of file
+    args = parse_args()
+    startup = StartupProfile() if args.profile_startup else None
+    if startup is not None:
+        startup.mark("imports")
+        if __spec__ is None:
+            # A script is compiled on every run; a module loads from __pycache__
+            startup.notes.append("Run as 'python -m Chatbot_improvised' to skip compiling the script on every start.")
+    knowledge = None
+    database = HistoryDatabase(args.db) if args.db else None
+    if database is not None and args.session is not None and not database.has_session(args.session):
+        sys.exit(f"❌ No session {args.session} in {args.db}")
+    if args.content and not args.batch:
+        knowledge = ContentLoader(args.content, args.reload_interval).start()
+    if args.dump_content:
+        with open(args.dump_content, 'w', encoding='utf-8') as file:
+            json.dump(KnowledgeBase.default().to_dict(), file, indent=2, ensure_ascii=False)
+    elif args.convert_transcripts is not None:
+        for path in args.convert_transcripts or sorted(glob.glob("chat_history_*.txt")):
+            try:
+                archive_path = convert_transcript(path)
+            except FileExistsError as e:
+                print(f"{path}: skipped, {e.filename} already exists")
+                continue
+            print(f"{path} -> {archive_path} ({os.path.getsize(path):,} -> {os.path.getsize(archive_path):,} bytes)")
+    elif args.batch:
+        runner = BatchRunner(args.name, args.workers, args.seed, args.chunk_size, args.content, args.classifier,
+                             args.word_boundaries, args.no_repeat, args.fuzzy)
+        instream = open(args.input, encoding='utf-8') if args.input else sys.stdin
+        outstream = open(args.output, 'w', encoding='utf-8') if args.output else sys.stdout
+        try:
+            runner.run(instream, outstream, args.jsonl)
+        finally:
+            if args.input:
+                instream.close()
+            if args.output:
+                outstream.close()
+    elif args.serve:
+        server = ChatServer(args.name, 1000 if args.max_history is None else args.max_history, knowledge, Metrics() if args.metrics else None,
+                            args.classifier, args.word_boundaries, database, args.seed, args.no_repeat,
+                            args.fuzzy)
+        try:
+            import asyncio
+            asyncio.run(server.serve(args.host, args.port, args.unix, args.metrics_port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        # You can change the bot's name with --name
+        journal = None
+        if args.journal is not None:
+            journal = TranscriptJournal(args.name, args.journal or None, fsync=args.fsync,
+                                        max_bytes=args.journal_max_bytes)
+        bot = SimpleChatBot(args.name, args.max_history, args.spill, args.search_transcripts, journal=journal,
+                            knowledge=knowledge, metrics=Metrics() if args.metrics else None, classifier=args.classifier,
+                            word_boundaries=args.word_boundaries, database=database, session=args.session,
+                            seed=args.seed, no_repeat=args.no_repeat, fuzzy=args.fuzzy)
+        if startup is not None:
+            startup.mark("setup")
+        bot.chat(startup)
+    if database is not None:
+        database.close()
\ No newline at end of file
@@ -0,0 +1,275 @@
+"""Benchmarks for the chatbot's hot paths
+
+Measures get_response throughput against intent tables of different sizes,
+and search_history, show_stats, show_history, save_conversation and the
+compressed archive (export, and loading the last 100 turns) against synthetic
+conversations of different lengths. Results are written as JSON:
+
+    python benchmarks.py                       # quick run
+    python benchmarks.py --full -o bench.json  # 1k/100k/1M turns, 10..10,000 patterns
+    python benchmarks.py --stress --threads 8 --messages 2000
+
+--stress instead shares one thread-safe bot between N threads sending M
+messages each (with /stats, /search and /history reads mixed in), checks
+that no turn was lost or torn, and exits non-zero if any check fails.
+
+--check-classifier scores messages against the built-in intents with the
+TF-IDF classifier (needs NumPy) and fails if an unrelated message reaches
+min_confidence or a plain intent message misses.
+"""
+import argparse
+import itertools
+import json
+import os
+import random
+import statistics
+import sys
+import tempfile
+import threading
+import time
+import tracemalloc
+from concurrent.futures import ThreadPoolExecutor
+
+from Chatbot_improvised import DEFAULT_RESPONSES, KnowledgeBase, Metrics, SimpleChatBot
+
+WORDS = ("hello hi thanks weather feeling good bad happy sad today tomorrow music movie "
+         "book dinner work coffee travel friend family game code python chat bot time").split()
+
+QUICK_SIZES = (1000, 100000)
+FULL_SIZES = (1000, 100000, 1000000)
+QUICK_PATTERNS = (10, 100, 1000)
+FULL_PATTERNS = (10, 100, 1000, 10000)
+
+
+def synthetic_message(rng):
+    return " ".join(rng.choice(WORDS) for _ in range(rng.randint(2, 12)))
+
+
+def build_conversation(turns, seed=0):
+    """Return a bot whose history holds `turns` synthetic turns"""
+    rng = random.Random(seed)
+    bot = SimpleChatBot("BenchBot")
+    for i in range(turns):
+        speaker = "You" if i % 2 == 0 else bot.name
+        bot._record(speaker, synthetic_message(rng))
+    return bot
+
+
+def build_intent_bot(patterns, seed=0, **options):
+    """Return a bot with roughly `patterns` extra intent patterns"""
+    rng = random.Random(seed)
+    table = dict(DEFAULT_RESPONSES)
+    per_category = 10
+    for c in range(max(1, patterns // per_category)):
+        literal = [f"topic{c}x{p} {rng.choice(WORDS)}" for p in range(per_category - 1)]
+        table[f"custom_{c}"] = {'patterns': literal + [rf"ask{c} about (\w+)"],
+                                'responses': [f"Custom answer {c}"]}
+    return SimpleChatBot("BenchBot", knowledge=KnowledgeBase(table), **options)
+
+
+def measure(fn, repeat, warmup=1):
+    """Time fn() `repeat` times; return a result dict with p50/p99 and peak memory"""
+    for _ in range(warmup):
+        fn()
+    samples = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - started)
+    samples.sort()
+
+    # Peak memory comes from a separate traced call so tracing doesn't skew timings
+    tracemalloc.start()
+    fn()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    return {
+        'runs': repeat,
+        'p50_ms': statistics.median(samples) * 1000,
+        'p99_ms': samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000,
+        'mean_ms': statistics.fmean(samples) * 1000,
+        'peak_memory_bytes': peak,
+    }
+
+
+def bench_get_response(pattern_counts, messages=2000):
+    results = []
+    rng = random.Random(1)
+    for patterns in pattern_counts:
+        inputs = [synthetic_message(rng) for _ in range(messages)]
+        inputs += [f"topic{rng.randrange(max(1, patterns // 10))}x3 now" for _ in range(messages // 4)]
+        for word_boundaries in (False, True):
+            bot = build_intent_bot(patterns, word_boundaries=word_boundaries)
+
+            def run():
+                bot.clear_history()
+                bot.knowledge.intent_cache.clear()  # time the matcher, not the cache
+                for text in inputs:
+                    bot.get_response(text)
+
+            result = measure(run, repeat=5)
+            result.update(name='get_response', patterns=patterns, messages=len(inputs),
+                          word_boundaries=word_boundaries,
+                          messages_per_sec=len(inputs) / (result['p50_ms'] / 1000))
+            results.append(result)
+    return results
+
+
+def bench_conversation(sizes, workdir):
+    results = []
+    for turns in sizes:
+        bot = build_conversation(turns)
+        loader = SimpleChatBot("BenchBot")
+        # Archives are never overwritten, so each export gets its own name
+        archive_paths = (f"bench_{turns}_{n}.chatz" for n in itertools.count())
+        small = turns <= 100000
+        cases = [
+            ('search_history', lambda: bot.search_history("coffee music"), 50),
+            ('search_history_prefix', lambda: bot.search_history("trav* friend"), 20),
+            ('show_stats', bot.show_stats, 200),
+            ('show_history', bot.show_history, 10 if small else 3),
+            ('save_conversation', bot.save_conversation, 5 if small else 2),
+            ('export_archive', lambda: bot.export_archive(next(archive_paths)), 3 if small else 1),
+            ('load_archive_last_100', lambda: loader.load_conversation(f"bench_{turns}_0.chatz", 100), 50),
+        ]
+        cwd = os.getcwd()
+        os.chdir(workdir)
+        try:
+            for name, fn, repeat in cases:
+                result = measure(fn, repeat)
+                result.update(name=name, turns=turns)
+                results.append(result)
+        finally:
+            os.chdir(cwd)
+    return results
+
+
+def stress(threads, messages, seed=0):
+    """Share one thread-safe bot between `threads` threads sending `messages` each"""
+    bot = SimpleChatBot("StressBot", thread_safe=True, metrics=Metrics())
+    barrier = threading.Barrier(threads)
+    errors = []
+
+    def worker(n):
+        rng = random.Random(f"{seed}:{n}")
+        barrier.wait()
+        try:
+            for i in range(messages):
+                bot.get_response(f"t{n}m{i} {synthetic_message(rng)}")
+                if i % 50 == 0:
+                    bot.respond("/stats")
+                    bot.respond(f"/search t{n}m*")
+                    "".join(bot.respond_chunks("/history --last 20"))
+        except Exception as e:
+            errors.append(f"thread {n}: {e!r}")
+
+    started = time.perf_counter()
+    with ThreadPoolExecutor(threads) as pool:
+        list(pool.map(worker, range(threads)))
+    elapsed = time.perf_counter() - started
+
+    expected = threads * messages
+    stats = bot.get_stats()
+    problems = list(errors)
+    if stats['total_messages'] != 2 * expected:
+        problems.append(f"history holds {stats['total_messages']} turns, expected {2 * expected}")
+    if stats['messages'].get("You") != expected or stats['messages'].get(bot.name) != expected:
+        problems.append(f"per-speaker counts {stats['messages']}, expected {expected} each")
+    if sum(stats['intents'].values()) != expected or bot.metrics.messages != expected:
+        problems.append("intent counts don't add up to the messages sent")
+    for n in range(threads):
+        # Each message carries a unique tag, so the search index tells where it landed
+        ids = [(bot.search_index.search(f"t{n}m{i}", 2)[0] or [None])[0] for i in range(messages)]
+        if None in ids:
+            problems.append(f"thread {n}: {ids.count(None)} messages missing from the search index")
+            continue
+        if ids != sorted(ids) or len(set(ids)) != len(ids):
+            problems.append(f"thread {n}: turns out of order or duplicated")
+        for turn_id in ids:
+            turn = bot.conversation_history.get(turn_id)
+            if turn is None or turn.speaker != "You" or not turn.message.startswith(f"t{n}m"):
+                problems.append(f"thread {n}: turn {turn_id} is missing or torn")
+                break
+    return {
+        'name': 'stress',
+        'threads': threads,
+        'messages': messages,
+        'seconds': elapsed,
+        'messages_per_sec': expected / elapsed,
+        'ok': not problems,
+        'problems': problems[:20],
+    }
+
+
+# Messages that share only common words with the built-in intents
+UNRELATED_MESSAGES = ("the best pizza in town", "that was a terrible movie", "is it over",
+                      "my car is in the shop", "what a day", "i left it on the table")
+INTENT_MESSAGES = {"thanks": "thanks", "good morning": "greeting", "i feel sad": "feeling",
+                   "what is your name": "name", "how are you": "how_are_you"}
+
+
+def check_classifier():
+    """Check the TF-IDF classifier against UNRELATED_MESSAGES and INTENT_MESSAGES"""
+    classifier = KnowledgeBase.default().classifier
+    problems = []
+    for message in UNRELATED_MESSAGES:
+        category, score = classifier.classify(message)
+        if category is not None:
+            problems.append(f"{message!r} scored {category} ({score:.2f})")
+    for message, expected in INTENT_MESSAGES.items():
+        category, score = classifier.classify(message)
+        if category != expected:
+            problems.append(f"{message!r} scored {category} ({score:.2f}), expected {expected}")
+    return {
+        'name': 'check_classifier',
+        'min_confidence': classifier.min_confidence,
+        'ok': not problems,
+        'problems': problems,
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument('--full', action='store_true', help="include 1M-turn conversations and 10,000 patterns")
+    parser.add_argument('--sizes', help="comma-separated conversation sizes in turns")
+    parser.add_argument('--patterns', help="comma-separated intent table sizes")
+    parser.add_argument('-o', '--output', help="write JSON results here instead of stdout")
+    parser.add_argument('--stress', action='store_true', help="run the thread-safety stress test instead")
+    parser.add_argument('--threads', type=int, default=8, help="threads for --stress")
+    parser.add_argument('--messages', type=int, default=2000, help="messages per thread for --stress")
+    parser.add_argument('--check-classifier', action='store_true',
+                        help="check the TF-IDF classifier's matches instead (needs NumPy)")
+    args = parser.parse_args(argv)
+
+    sizes = FULL_SIZES if args.full else QUICK_SIZES
+    patterns = FULL_PATTERNS if args.full else QUICK_PATTERNS
+    if args.sizes:
+        sizes = tuple(int(n) for n in args.sizes.split(','))
+    if args.patterns:
+        patterns = tuple(int(n) for n in args.patterns.split(','))
+
+    report = {
+        'python': sys.version.split()[0],
+        'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S'),
+    }
+    if args.stress:
+        report['results'] = [stress(args.threads, args.messages)]
+    elif args.check_classifier:
+        report['results'] = [check_classifier()]
+    else:
+        with tempfile.TemporaryDirectory() as workdir:
+            report['results'] = bench_get_response(patterns) + bench_conversation(sizes, workdir)
+
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            file.write(text + "\n")
+    else:
+        print(text)
+    if not all(result.get('ok', True) for result in report['results']):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()